@@ -2,9 +2,9 @@
 Provides functions to analyse a DataObject
 """
 
-from calendar import month_name
-from datetime import datetime, date
-from itertools import groupby, count
+import numpy as np
+from calendargroup import group_by, date_label
+from streaks import Streaks
 datefmt = '%d %b %Y'
 
 def _round(n):
@@ -52,81 +52,111 @@ def _normalise(time, value, wrt='min'):
     return mult * value / time
 
 
+def avg_speed(time, dist):
+    """ Return array of average speeds (in km/h) for arrays of durations
+        `time` (in seconds) and distances `dist`.
+
+        Sessions with a time of 0 have no average speed, so are NaN, and are
+        left out wherever sessions are compared by speed.
+    """
+    time = np.asarray(time, dtype=np.float64)
+    dist = np.asarray(dist, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(time > 0, dist / (time / 3600), np.nan)
+
+
+def fastest(time, dist):
+    """ Return index and average speed of the fastest session (the first, if
+        there is a tie), or None and 0 if no session has a time.
+    """
+    speed = avg_speed(time, dist)
+    valid = ~np.isnan(speed)
+    if not np.any(valid):
+        return None, 0
+    idx = int(np.flatnonzero(valid)[np.argmax(speed[valid])])
+    return idx, float(speed[idx])
+
+
+def summarised(data):
+    """ Return True if `data` finds its own personal bests, from summaries
+        of the years which haven't been read, as ShardedData do.
+    """
+    return hasattr(data, 'best_session')
+
+
 def get_best_session(data):
     
-    when = ''
-    best = 0
+    if summarised(data):
+        return data.best_session()
+
+    idx, best = fastest(data.getColumn('Time'),
+                        data.getColumn('Distance (km)'))
+    if idx is None:
+        return 0, ''
     
-    for d in data:
-        time = minsec_to_hr(d[1])
-        avg_speed = d[2]/time
-        if avg_speed > best:
-            best = avg_speed
-            year, mnth, day = d[0].split('-')
-            when = day + ' ' + month_name[int(mnth)] + ' ' + year
-            
-    return best, when
+    return best, date_label(data[idx, 'Date'])
 
 
 def get_best_month(data):
+
+    if summarised(data):
+        return data.best_month()
     
-    months = split_by_month(data)
+    months = group_by(data, 'month')
+    dist = months.totals['distance (km)']
     
-    best = 0
-    when = ''
-    time = ''
-    cal = 0
+    if len(months) == 0 or np.max(dist) <= 0:
+        return 0, '', '', 0
     
-    for month in months:
-        
-        dist = sum([m[2] for m in month])
-        
-        if dist > best:
-            
-            best = dist
-            
-            year, mnth, _ = month[0][0].split('-')
-            when = month_name[int(mnth)] + ' ' + year
-            
-            time = sum([minsec_to_hr(item[1]) for item in month])
-            time = hr_to_hrminsec(time)
-            cal = sum([m[3] for m in month])
+    # first month with the greatest distance
+    idx = int(np.argmax(dist))
+    best = float(dist[idx])
+    when = months.label(idx)
+    time = hr_to_hrminsec(months.totals['time'][idx] / 3600)
+    cal = float(months.totals['calories'][idx])
     
     return best, when, time, cal
 
 
 def get_best_days(data):
     
-    fmt = '%Y-%m-%d'
-    days = [datetime.strptime(d[0], fmt).toordinal() for d in data]
-    c = count()
-    groups = [list(g) for _, g in groupby(days, lambda x: x-next(c))]
-    days = max(list(reversed(groups)), key=len)
-#    days = max((list(g) for _, g in groupby(days, lambda x: x-next(c))), key=len)
-    days = [date.fromordinal(d) for d in days]
-    duration = len(days)
-    first, last = (days[i].strftime(datefmt) for i in [0, -1])
+    if summarised(data):
+        return data.longest_streak()
+
+    # most recent of the longest runs
+    return _format_streak(Streaks.fromData(data).longest())
+
+
+def get_current_streak(data, today=None):
+    """ Return length, first and last days of the run of consecutive days
+        which includes `today` (by default, the current date) or ends the day
+        before.
+    """
+    return _format_streak(Streaks.fromData(data).current(today))
+
+
+def get_year_streaks(data):
+    """ Return dict of the length, first and last days of the longest run of
+        consecutive days in each year.
+    """
+    streaks = Streaks.fromData(data).byYear()
+    return {year: _format_streak(streak) for year, streak in streaks.items()}
+
+
+def _format_streak(streak):
+    duration, first, last = streak
+    if duration == 0:
+        return 0, '', ''
+    first, last = (day.item().strftime(datefmt) for day in [first, last])
     return duration, first, last
         
 
 def split_by_month(data):
+    """ Return list of the rows of each month, in date order. """
+    
+    months = group_by(data, 'month', columns=[])
     
-    result = []
-    prev_month = ''
-    this_month = []
-    
-    for idx, item in enumerate(data.getColumn(0)):
-        _, month, _ = item.split('-')
-        if month == prev_month:
-            this_month.append(data[idx])
-            prev_month = month
-        else:
-            result.append(this_month)
-            this_month = [data[idx]]
-            prev_month = month
-            
-    result.append(this_month)
-            
-    result.pop(0)
+    result = [[data[int(idx)] for idx in months.rows(n)]
+              for n in range(len(months))]
     
     return result
@@ -0,0 +1,167 @@
+"""
+Group sessions by day, ISO week, month or year
+
+Each date is given an integer key for its period, the sessions are sorted by
+date and the totals of each group are found with sorted-segment reductions
+(np.add.reduceat), so no Python loop runs over the sessions.
+"""
+
+import calendar
+import numpy as np
+
+freqs = ['day', 'week', 'month', 'year']
+
+
+def group_keys(dates, freq):
+    """ Return array of integer keys of the periods containing `dates`.
+
+        Keys increase with date. They are the number of days, ISO weeks,
+        months or years since the one containing 1970-01-01.
+    """
+    if freq == 'day':
+        return dates.astype('datetime64[D]').astype(np.int64)
+    elif freq == 'week':
+        # ISO weeks start on Monday; 1970-01-01 was a Thursday
+        return (dates.astype('datetime64[D]').astype(np.int64) + 3) // 7
+    elif freq == 'month':
+        return dates.astype('datetime64[M]').astype(np.int64)
+    elif freq == 'year':
+        return dates.astype('datetime64[Y]').astype(np.int64)
+    raise ValueError(f"'freq' should be one of {', '.join(freqs)}, not "
+                     f"'{freq}'")
+
+
+def key_range(freq, key):
+    """ Return first and last dates (as datetime64[D]) of period `key`. """
+    if freq == 'day':
+        first = np.datetime64(int(key), 'D')
+        return first, first
+    elif freq == 'week':
+        first = np.datetime64(int(key) * 7 - 3, 'D')
+        return first, first + np.timedelta64(6, 'D')
+    unit = 'M' if freq == 'month' else 'Y'
+    first = np.datetime64(int(key), unit)
+    last = (first + 1).astype('datetime64[D]') - np.timedelta64(1, 'D')
+    return first.astype('datetime64[D]'), last
+
+
+def month_label(year, month):
+    """ Return name of `month` (1-12) of `year`, e.g. 'January 2020'. """
+    return f'{calendar.month_name[int(month)]} {year}'
+
+
+def date_label(date, short=False):
+    """ Return 'YYYY-MM-DD' `date` as e.g. '05 January 2020', or as
+        '05 Jan 20' if `short` is True.
+    """
+    year, month, day = str(date).split('-')
+    if short:
+        return f'{day} {calendar.month_abbr[int(month)]} {year[-2:]}'
+    return f'{day} {month_label(year, month)}'
+
+
+def key_label(freq, key):
+    """ Return name of period `key`, e.g. '2020-01-31', '2020-W05',
+        'January 2020' or '2020'.
+    """
+    if freq == 'day':
+        return str(np.datetime64(int(key), 'D'))
+    elif freq == 'week':
+        # the ISO year is the year of the week's Thursday
+        thursday = np.datetime64(int(key) * 7, 'D')
+        year = thursday.astype('datetime64[Y]')
+        week = (thursday - year.astype('datetime64[D]')).astype(int) // 7 + 1
+        return f'{year}-W{week:02d}'
+    elif freq == 'month':
+        year, month = divmod(int(key), 12)
+        return month_label(year + 1970, month + 1)
+    elif freq == 'year':
+        return str(int(key) + 1970)
+    raise ValueError(f"'freq' should be one of {', '.join(freqs)}, not "
+                     f"'{freq}'")
+
+
+class Groups:
+
+    def __init__(self, freq, keys, order, starts, counts, totals):
+        """ Sessions grouped by period.
+
+            Attributes
+            ----------
+            freq : {'day', 'week', 'month', 'year'}
+            keys : array of the key of each group (see `group_keys`)
+            order : array of row indices which sorts the data by date
+            starts : array of the position in `order` where each group starts
+            counts : array of the number of sessions in each group
+            totals : dict of arrays of the total of each column in each group
+        """
+        self.freq = freq
+        self.keys = keys
+        self.order = order
+        self.starts = starts
+        self.counts = counts
+        self.totals = totals
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def ends(self):
+        """ Array of the position in `order` after the end of each group. """
+        return self.starts + self.counts
+
+    def rows(self, n):
+        """ Return array of the row indices of group `n`, in date order. """
+        start = self.starts[n]
+        return self.order[start:start+self.counts[n]]
+
+    def label(self, n):
+        """ Return name of the period of group `n`. """
+        return key_label(self.freq, self.keys[n])
+
+    def range(self, n):
+        """ Return first and last dates of the period of group `n`. """
+        return key_range(self.freq, self.keys[n])
+
+
+def group_by(data, freq='month', columns=('time', 'distance (km)', 'calories'),
+             reverse=False):
+    """ Group the sessions in `data` by period and total `columns`.
+
+        Parameters
+        ----------
+        data : Data object
+        freq : {'day', 'week', 'month', 'year'}
+            length of the periods. Default is 'month'.
+        columns : list of str
+            columns to total. Default is time, distance and calories.
+        reverse : bool
+            if True, the groups and the sessions in them are most recent
+            first, with sessions on the same day in reverse order of their
+            rows. Default is False.
+
+        Returns
+        -------
+        Groups
+    """
+    dates = data.getColumn('date')
+    num = len(dates)
+
+    order = np.argsort(dates, kind='stable')
+    if reverse:
+        order = order[::-1]
+    keys = group_keys(dates[order], freq)
+
+    if num == 0:
+        starts = np.zeros(0, dtype=np.int64)
+    else:
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    counts = np.diff(np.concatenate((starts, [num])))
+
+    totals = {}
+    for name in columns:
+        col = data.getColumn(name)[order].astype(np.float64)
+        totals[name] = (np.add.reduceat(col, starts) if num > 0
+                        else np.zeros(0))
+
+    return Groups(freq, keys[starts], order, starts, counts, totals)
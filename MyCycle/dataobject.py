@@ -2,25 +2,134 @@
 Data object for MyCycle
 """
 
+import io
 import os.path
+from contextlib import contextmanager
+import numpy as np
+from lazycsv import LazyCsv
+import parsecache
+from undo import UndoStack, CellChanged, RowAdded, RowRemoved, Reloaded
+from schema import (default_columns, kind_dtypes, column_kinds, parse_column,
+                    parse_value, sec_to_minsec, format_float, format_column)
+
+# number of rows written to the csv file at a time
+write_chunk = 4096
+
+
+class CsvChangedError(Exception):
+    """ Raised when saving would overwrite changes made to the csv file by
+        another program.
+    """
 
 class Data:
     # separate class to handle all the data
     
-    def __init__(self, fname):
-        """ Object that controls the csv data. """
+    def __init__(self, fname, journal=False, journal_limit=500, lazy=False,
+                 cache=False, undo_depth=100, readonly=False):
+        """ Object that controls the csv data.
+
+            The data are stored column-wise, with one typed numpy array per
+            column: dates as datetime64[D], durations as integer seconds and
+            distance, calories and odometer as float64.
+
+            Parameters
+            ----------
+            fname : str
+                path to csv file
+            journal : bool, optional
+                If True, `save` appends the changes to a journal file next to
+                the csv, rather than rewriting the whole csv. The journal is
+                replayed when the data are read. Default is False.
+            journal_limit : int, optional
+                Number of journal records after which the journal is folded
+                back into the csv. Default is 500.
+            lazy : bool, optional
+                If True, the csv is memory-mapped and rows are only parsed
+                when accessed with `getRow` or `__getitem__`. The columns are
+                built the first time they are needed, i.e. by `getColumn` or
+                any change to the data. Default is False.
+            cache : bool, optional
+                If True, the parsed columns are read from a binary cache next
+                to the csv, if the cache is up to date. Otherwise, the csv is
+                parsed and the cache is written. Default is False.
+            undo_depth : int, optional
+                Maximum number of changes that can be undone. Default is 100.
+            readonly : bool, optional
+                If True, no file is written: the csv isn't made if it doesn't
+                exist, the cache is read but not written and the journal is
+                replayed, but not folded into the csv or removed. `save`
+                raises PermissionError. Default is False.
+        """
         
         self.modified = False
+
+        # changes that can be undone
+        self.history = UndoStack(undo_depth)
+        # functions to call with each list of changes
+        self._listeners = []
+        # changes not yet sent to the listeners, while in `undoGroup`
+        self._batch = None
+
+        self.journal = journal
+        self.journal_limit = journal_limit
+        self.journalfile = fname + '.journal'
+        # records not yet written to the journal and number already written
+        self._pending = []
+        self._journal_len = 0
+        # LazyCsv object, if the columns haven't been built yet
+        self._lazy = None
+        self.cache = cache
+        # sorted dates and their order, for each date column
+        self._date_index = {}
+        # cached statistics of each column (see `unique`, `valueCounts`,
+        # `describe` and `histogram`)
+        self._stats = {}
+        # csv text of each row (None for rows which need formatting), or None
+        # if no rows have been formatted yet. Rows are kept as they were read
+        # until they are changed, so they are written again exactly as they
+        # were.
+        self._row_strings = None
+        # text of each row of the csv last parsed
+        self._read_rows = None
+        # size, modification time and hash of the csv when last read or
+        # written, and whether it has since been changed by another program
+        # in a way that can't be merged
+        self._file_state = None
+        self.externally_modified = False
+        # whether the journal has to be folded into the csv at the next save,
+        # as rows were appended to the csv while there were unsaved changes
+        self._fold_journal = False
+        # whether the journal was made for a version of the csv which has
+        # since been changed, so hasn't been applied
+        self.journal_conflict = False
+        self.readonly = readonly
             
         try:
-            self.csv_exists(fname)
+            if not readonly:
+                self.csv_exists(fname)
             self.csvfile = fname
         except:
             raise Exception('mycycle.csv does not exist and could not make it.')
         
-        self.col_names, self.df = self.read()
+        if readonly and not os.path.exists(fname):
+            # the csv isn't made, so there are no sessions
+            self.col_names, columns = self._parse(','.join(default_columns))
+            self._setColumns(columns)
+        elif lazy:
+            self.col_names = self._readLazy()
+        elif cache:
+            self.col_names, columns = self._readCached()
+            self._setColumns(columns, self._read_rows)
+        else:
+            self.col_names, columns = self.read()
+            self._setColumns(columns, self._read_rows)
         
         self.aliases = [item.lower() for item in self.col_names]
+
+        if self.journal:
+            self._replayJournal()
+
+        self._markFile()
         
         
     @staticmethod
@@ -29,7 +138,7 @@ class Data:
         if not os.path.exists(fname):
             d = os.path.split(fname)[0]
             os.makedirs(d, exist_ok=True)
-            header = 'Date,Time,Distance (km),Calories,Odometer (km),Gear,Weight (kg)\n'
+            header = ','.join(default_columns) + '\n'
             with open(fname, 'w') as fileobj:
                 fileobj.write(header)
                 
@@ -37,85 +146,587 @@ class Data:
         
         
     def read(self):
-        """ Read csv file and return list of headers and list of rows. """
+        """ Read csv file and return list of headers and list of columns. """
         
         # read csv file
         with open(self.csvfile) as fileobj:
             csv_str = fileobj.read()
             
+        return self._parse(csv_str)
+
+
+    def _parse(self, csv_str):
+        """ Return list of headers and list of columns from csv string.
+
+            The text of each row is kept in `_read_rows`.
+        """
+
         # get list of rows (where each row is a string)
         df = csv_str.split('\n')
         df = list(filter(None, df))
         
         # split column names from data
         header, *df = df
+        self._read_rows = df
         # make list of headers
         header = header.split(',')
         
         if df:
-            # make each row into a list
-            df = [df[n].split(',') for n in range(len(df))]
-            # get type for each item in a row
-            self.types = self._get_types(df[0])
-            
-            # cast every item in the frame as its appropriate type
-            for idx, row in enumerate(df):
-                for n in range(len(df[0])):
-                    row[n] = self.types[n](row[n])
+            # split every row at once, then take every column as a slice
+            ncols = len(header)
+            cells = ','.join(df).split(',')
+            if len(cells) != len(df) * ncols:
+                raise ValueError('Every row should have {} elements'
+                                 .format(ncols))
+            columns = [cells[n::ncols] for n in range(ncols)]
+            # get kind of data in each column
+            self.kinds = column_kinds(header, columns)
+            # cast each column in bulk
+            columns = [parse_column(kind, col, name)
+                       for kind, col, name in zip(self.kinds, columns, header)]
                 
         else:
             # there is no data yet
-            # and self.types hasn't been initialised
-            self.types = None
+            # and self.kinds hasn't been initialised
+            self.kinds = None
+            columns = None
             
-        return header, df
+        return header, columns
+
+
+    def _readCached(self):
+        """ Return list of headers and list of columns from the parse cache.
+
+            If the cache is out of date, the csv is read and the cache written.
+        """
+        cached = parsecache.load(self.csvfile)
+        if cached is not None:
+            header, self.kinds, columns = cached
+            # the text of the rows is still needed to write them again as
+            # they are, but it doesn't have to be parsed
+            with open(self.csvfile) as fileobj:
+                rows = list(filter(None, fileobj.read().split('\n')))[1:]
+            self._read_rows = rows if len(rows) == len(columns[0]) else None
+            return header, columns
+
+        header, columns = self.read()
+        if columns is not None and not self.readonly:
+            parsecache.write(self.csvfile, header, self.kinds, columns)
+        return header, columns
+
+
+    def _readLazy(self):
+        """ Memory-map csv file and return list of headers.
+
+            Rows are parsed when they are accessed.
+        """
+        lazy = LazyCsv(self.csvfile, parse=self._parseRow)
+        header = lazy.header
+
+        if len(lazy) > 0:
+            # any non-standard columns have their kind inferred from the first
+            # row until the columns are built
+            self.kinds = column_kinds(header, [[v] for v in lazy.fields(0)])
+            self._lazy = lazy
+            self._len = len(lazy)
+            self._data = None
+        else:
+            lazy.close()
+            self.kinds = None
+            self._setColumns(None)
+
+        return header
+
+
+    def _parseRow(self, fields):
+        """ Convert list of strings from the csv to a row of Python values. """
+        return [self._toPython(n, self._toStorage(n, item))
+                for n, item in enumerate(fields)]
+
+
+    def _materialize(self):
+        """ If the csv was read lazily, build the column arrays now. """
+        if self._lazy is not None:
+            _, columns = self._parse(self._lazy.text())
+            self._lazy.close()
+            self._lazy = None
+            self._setColumns(columns, self._read_rows)
+
+
+    def _setColumns(self, columns, rows=None):
+        """ Set the column arrays that hold the data.
+
+            `rows` is the csv text of each row, if it is known.
+        """
+        self._date_index = {}
+        self._stats = {}
+        self._row_strings = None if rows is None else list(rows)
+        self._read_rows = None
+        if columns is None:
+            self._len = 0
+            self._data = None
+        else:
+            self._len = len(columns[0])
+            self._data = list(columns)
         
         
-    def save(self):
-        """ If csv data has been modifed, save the file. """
+    def save(self, force=False):
+        """ If csv data has been modifed, save the file.
+
+            In journal mode, only the changes made since the last save are
+            written, unless the journal has grown past `journal_limit`, in
+            which case it is compacted into the csv.
+
+            Rows appended to the csv by another program are merged first. If
+            the csv has been changed in any other way, CsvChangedError is
+            raised, unless `force` is True, in which case those changes are
+            overwritten.
+
+            Returns True if anything was written.
+        """
+        if self.readonly:
+            raise PermissionError(f"'{self.csvfile}' was opened read-only")
+        if force and self.externally_modified:
+            self._writeCsv()
+            self.modified = False
+            return True
+
+        self.checkFile()
         if self.modified:
-            csv_str = self.__str__()
-            with open(self.csvfile, 'w') as fileobj:
-                fileobj.write(csv_str)
+            if self.externally_modified:
+                raise CsvChangedError(f"'{self.csvfile}' has been changed by "
+                                      "another program")
+            n = self._journal_len + len(self._pending)
+            if (self.journal and not self.journal_conflict
+                    and not self._fold_journal and n <= self.journal_limit):
+                self._appendJournal()
+            else:
+                self._writeCsv()
+            self.modified = False
+            return True
+        return False
+
+
+    def _markFile(self):
+        """ Store the size, modification time and hash of the csv file. """
+        try:
+            st = os.stat(self.csvfile)
+        except FileNotFoundError:
+            self._file_state = None
+            return
+        digest = parsecache.full_hash(self.csvfile, st.st_size)
+        self._file_state = (st.st_size, st.st_mtime_ns, digest)
+        self.externally_modified = False
+
+
+    def checkFile(self):
+        """ Check if the csv file has been changed by another program.
+
+            This only compares the size and modification time with those from
+            when the file was last read or written, so it can be called often.
+
+            If rows have been appended, just those rows are parsed and added
+            to the end of the data. If the existing content has changed, or
+            the new rows can't be merged, the file is read again, unless there
+            are unsaved or journaled changes, in which case
+            `externally_modified` is set and `save` will refuse to write the
+            file.
+
+            Returns True if the data were updated.
+        """
+        if self._file_state is None or self.externally_modified:
+            return False
+        try:
+            st = os.stat(self.csvfile)
+        except FileNotFoundError:
+            return False
+        size, mtime, digest = self._file_state
+        if st.st_size == size and st.st_mtime_ns == mtime:
+            return False
+
+        if (st.st_size > size
+                and parsecache.full_hash(self.csvfile, size) == digest):
+            # only new rows appended (the whole of the old content is hashed,
+            # so that an edit anywhere in it isn't taken for an append)
+            try:
+                if self._mergeTail(size):
+                    return True
+            except ValueError:
+                # the last row may still be being written, so try again
+                # next time
+                return False
+
+        if self.modified or self._journal_len > 0:
+            # unsaved (or only journaled) changes would be lost by reading
+            # the file again
+            self.externally_modified = True
+            return False
+
+        try:
+            self.reload()
+        except ValueError:
+            # file may still be being written, so try again next time
+            return False
+        return True
+
+
+    def _mergeTail(self, offset):
+        """ Add the rows written after byte `offset` of the csv file.
+
+            Returns False if the new text doesn't start on a new line. If any
+            of the new rows can't be parsed, ValueError is raised and no rows
+            are added.
+        """
+        rows = self._readTail(offset)
+        if rows is None:
+            return False
+        for row in rows:
+            if len(row) != self.shape[1]:
+                raise ValueError('New row should have {} elements'
+                                 .format(self.shape[1]))
+            if self.kinds is not None:
+                for n, item in enumerate(row):
+                    self._toStorage(n, item)
+
+        modified = self.modified
+        start = self._len
+        for row in rows:
+            idx = self._insertRow(self._len, row)
+            if self._row_strings is not None:
+                # written again as the other program wrote it
+                self._row_strings[idx] = ','.join(row)
+        self.modified = modified
+
+        # the new rows aren't changes made here, so they can't be undone
+        self._notify([RowAdded(idx, self.getRow(idx))
+                      for idx in range(start, self._len)])
+
+        self._markFile()
+        if (self.journal and not self.readonly
+                and (self._journal_len > 0 or self._pending)):
+            # the journal was made for the csv without the new rows, so it is
+            # folded into the csv: now, if that only writes saved changes,
+            # otherwise at the next save
+            if self.modified:
+                self._fold_journal = True
+            else:
+                self._writeCsv()
+        return True
+
+
+    def _readTail(self, offset):
+        """ Return list of the rows, split into fields, written after byte
+            `offset` of the csv file, or None if they don't start on a new
+            line.
+        """
+        with open(self.csvfile, 'rb') as fileobj:
+            fileobj.seek(max(offset - 1, 0))
+            text = fileobj.read().decode()
+        if offset > 0:
+            # the new rows must start after a line break
+            if not text.startswith('\n') and not text[1:].startswith('\n'):
+                return None
+            text = text[1:]
+        return [line.split(',') for line in text.split('\n') if line]
+
+
+    def reload(self):
+        """ Read the csv file again, discarding any unsaved changes.
+
+            If the file can't be parsed, ValueError is raised and the data are
+            left unchanged.
+        """
+        kinds = self.kinds
+        try:
+            if self.cache:
+                header, columns = self._readCached()
+            else:
+                header, columns = self.read()
+        except ValueError:
+            self.kinds = kinds
+            raise
+        if self._lazy is not None:
+            self._lazy.close()
+            self._lazy = None
+        self.col_names = header
+        self._setColumns(columns, self._read_rows)
+        self.aliases = [item.lower() for item in self.col_names]
+
+        # the journal is replayed again, if it still applies to the csv
+        self._pending = []
+        self._journal_len = 0
+        self._fold_journal = False
+        if self.journal:
+            self._replayJournal()
+
+        self.history = UndoStack(self.history.depth)
+        self.modified = False
+        self._markFile()
+        self._notify([Reloaded()])
+
+
+    def _writeCsv(self):
+        """ Write all data to the csv file and remove the journal. """
+        tmp = self.csvfile + '.tmp'
+        with open(tmp, 'w') as fileobj:
+            self._writeLines(fileobj)
+            if self._len > 0:
+                # so that rows appended by other programs start on a new line
+                fileobj.write('\n')
+
+        folded = (os.path.exists(self.journalfile)
+                  and not self.journal_conflict)
+        if folded:
+            # if the journal can't be removed once the csv is replaced, this
+            # shows it has been folded into the new csv
+            with open(self.journalfile, 'a') as fileobj:
+                fileobj.write('# folded {}\n'.format(self._signature(tmp)))
+        os.replace(tmp, self.csvfile)
+        self._markFile()
+
+        if self.cache and self._data is not None:
+            columns = [col[:self._len] for col in self._data]
+            parsecache.write(self.csvfile, self.col_names, self.kinds, columns)
+
+        if folded:
+            os.remove(self.journalfile)
+        self._pending = []
+        self._journal_len = 0
+        self._fold_journal = False
+
+
+    def _signature(self, fname=None, size=None):
+        """ Return size and hash of the first `size` bytes (by default, all)
+            of `fname` (by default, the csv file), as a string.
+        """
+        if fname is None:
+            fname = self.csvfile
+        if size is None:
+            size = os.path.getsize(fname)
+        return '{} {}'.format(size, parsecache.full_hash(fname, size))
+
+
+    def _journalBase(self):
+        """ Return first line of journal, identifying the csv it applies to. """
+        return '# base {}'.format(self._signature())
+
+
+    def _appendJournal(self):
+        """ Append pending records to the journal file. """
+        lines = [record + '\n' for record in self._pending]
+        if not os.path.exists(self.journalfile):
+            lines.insert(0, self._journalBase() + '\n')
+        with open(self.journalfile, 'a') as fileobj:
+            fileobj.writelines(lines)
+
+        self._journal_len += len(self._pending)
+        self._pending = []
+
+
+    def _replayJournal(self):
+        """ Apply the records in the journal file to the data from the csv.
+
+            If rows have been appended to the csv since the journal was
+            started, the records are applied to the rows that were there
+            before, the new rows are added after them and the journal is
+            folded into the csv. If the csv has been changed in any other
+            way, the journal is left as it is and `journal_conflict` is set;
+            `applyJournal` or `discardJournal` can then be called.
+        """
+        self.journal_conflict = False
+        if not os.path.exists(self.journalfile):
+            return
+
+        with open(self.journalfile) as fileobj:
+            base, *records = fileobj.read().split('\n')
+        records = [record for record in records if record]
+        folded = [record[len('# folded '):] for record in records
+                  if record.startswith('# folded ')]
+        records = [record for record in records if not record.startswith('#')]
+
+        # the csv may have been rewritten after the journal was started
+        base = base[len('# base '):].split()
+        current = self._signature()
+        if folded and folded[-1] == current:
+            # the journal was folded into the csv, but not removed
+            if not self.readonly:
+                os.remove(self.journalfile)
+            return
+
+        size = os.path.getsize(self.csvfile)
+        if ' '.join(base) == current or base == [str(size)]:
+            # the csv is the one the journal was started with (journals
+            # written before the hash was stored only have the size)
+            tail = []
+        elif (len(base) == 2 and size > int(base[0])
+                and self._signature(size=int(base[0])) == ' '.join(base)):
+            # rows appended to the csv by another program
+            tail = self._readTail(int(base[0]))
+        else:
+            tail = None
+        if tail is None:
+            self.journal_conflict = True
+            return
+
+        with self.history.paused():
+            appended = [self.getRow(idx)
+                        for idx in range(self._len - len(tail), self._len)]
+            if appended:
+                self._materialize()
+                num = self._len - len(tail)
+                rows = self._row_strings
+                self._setColumns([col[:num] for col in self._data],
+                                 None if rows is None else rows[:num])
+            self._applyRecords(records)
+            for row, text in zip(appended, tail):
+                idx = self._insertRow(self._len, row)
+                if self._row_strings is not None:
+                    self._row_strings[idx] = ','.join(text)
+
+        # the replayed records are already in the journal
+        self._pending = []
+        self._journal_len = len(records)
+        self.modified = False
+        if appended and not self.readonly:
+            # the journal no longer matches the csv, so fold it in now
+            self._writeCsv()
+
+
+    def _applyRecords(self, records):
+        """ Apply list of journal `records` to the data. """
+        for record in records:
+            op, *args = record.split(',')
+            if op == 'a':
+                self.addRow(args)
+            elif op == 'i':
+                self.insertRow(int(args[0]), args[1:])
+            elif op == 's':
+                self[int(args[0]), int(args[1])] = args[2]
+            elif op == 'r':
+                self.removeRow(int(args[0]))
+            else:
+                raise ValueError("Unrecognised journal record '{}'"
+                                 .format(record))
+
+
+    def applyJournal(self):
+        """ Apply the journal to the csv as it is now, after it was found not
+            to match (see `journal_conflict`), and fold it into the csv.
+
+            If any record doesn't fit the current data, ValueError or
+            IndexError is raised and the data are read again.
+        """
+        with open(self.journalfile) as fileobj:
+            records = [record for record in fileobj.read().split('\n')
+                       if record and not record.startswith('#')]
+        try:
+            with self.history.paused(), self._batchChanges():
+                self._applyRecords(records)
+        except (ValueError, IndexError):
+            self.reload()
+            raise
+        self.journal_conflict = False
+        self._writeCsv()
+        self.modified = False
+
+
+    def discardJournal(self):
+        """ Set aside the journal, after it was found not to match the csv
+            (see `journal_conflict`).
+
+            The journal is renamed to `journalfile` + '.old', rather than
+            removed.
+        """
+        if os.path.exists(self.journalfile):
+            os.replace(self.journalfile, self.journalfile + '.old')
+        self.journal_conflict = False
+
+
+    def _record(self, op, *args):
+        """ In journal mode, store a record of a change to be saved. """
+        if self.journal:
+            self._pending.append(','.join([op] + [str(arg) for arg in args]))
         
         
     def __str__(self):
+        buffer = io.StringIO()
+        self._writeLines(buffer)
+        return buffer.getvalue()
         
-        header = ','.join(self.col_names)
-        
-        # make list of strings
-        rows = []
-        for idx in range(self.__len__()):
-            row = self.getRow(idx)
-            row = list(map(str, row))
-            rows.append(','.join(row))
+
+    def _writeLines(self, fileobj):
+        """ Write header and rows to `fileobj`, `write_chunk` rows at a time.
+        """
+        self._materialize()
+
+        fileobj.write(','.join(self.col_names) + '\n')
             
         # remove empty strings
-        rows = list(filter(None, rows))
-        rows = '\n'.join(rows)
-        
-        frame = header + '\n' + rows
+        rows = [row for row in self._rowStrings() if row]
         
-        # return string
-        return frame
+        for start in range(0, len(rows), write_chunk):
+            if start > 0:
+                fileobj.write('\n')
+            fileobj.write('\n'.join(rows[start:start+write_chunk]))
     
     
     def __repr__(self):
         return self.__str__()
+
+    def _rowString(self, idx):
+        """ Return row `idx` formatted as a line of the csv file. """
+        if self._row_strings is None:
+            row = self.getRow(idx)
+            return ','.join(self._formatItem(n, item)
+                            for n, item in enumerate(row))
+        idx = self._checkRowIndex(idx)
+        if self._row_strings[idx] is None:
+            row = self.getRow(idx)
+            self._row_strings[idx] = ','.join(self._formatItem(n, item)
+                                              for n, item in enumerate(row))
+        return self._row_strings[idx]
+
+    def _rowStrings(self):
+        """ Return list of every row formatted as a line of the csv file.
+
+            The text of each row is kept until that row is changed, so only
+            new and changed rows are formatted again.
+        """
+        if self._row_strings is None:
+            # format whole columns at once
+            columns = [format_column(kind, col[:self._len])
+                       for kind, col in zip(self.kinds or [], self._data or [])]
+            self._row_strings = [','.join(items) for items in zip(*columns)]
+        else:
+            for idx, row in enumerate(self._row_strings):
+                if row is None:
+                    self._rowString(idx)
+        return self._row_strings
             
     @property
     def columns(self):
         return self.col_names
         
     def __len__(self):
-        return len(self.df)
+        return self._len
     
     @property
     def shape(self):
         return self.__len__(), len(self.columns)
     
     def getRow(self, idx):
-        return self.df[idx]
+        if self._lazy is not None:
+            return list(self._lazy[idx])
+        idx = self._checkRowIndex(idx)
+        return [self._toPython(n, col[idx]) for n, col in enumerate(self._data)]
+
+    def _checkRowIndex(self, idx):
+        """ Return non-negative row index, raising IndexError if invalid. """
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('Data index out of range')
+        return idx
     
     def __setitem__(self, key, value):
         
@@ -123,8 +734,19 @@ class Data:
             raise ValueError('Indices should be tuple')
         else:
             idx0, idx1 = key
-            self.df[idx0][idx1] = value
+            self._materialize()
+            idx0 = self._checkRowIndex(idx0)
+            idx1 = self._getColumnIndex(idx1)
+            old = self._toPython(idx1, self._data[idx1][idx0])
+            self._data[idx1][idx0] = self._toStorage(idx1, value)
+            self._date_index.pop(idx1, None)
+            self._stats.pop(idx1, None)
+            if self._row_strings is not None:
+                self._row_strings[idx0] = None
             self.modified = True
+            value = self._toPython(idx1, self._data[idx1][idx0])
+            self._record('s', idx0, idx1, self._formatItem(idx1, value))
+            self._changed(CellChanged(idx0, idx1, old, value))
 
     
     def __getitem__(self, key):
@@ -137,16 +759,23 @@ class Data:
 
     def _getItemTuple(self, tup):
         
-        row = self.getRow(tup[0])
         idx = self._getColumnIndex(tup[1])
+        if self._lazy is not None:
+            return self._lazy[tup[0]][idx]
+        row = self._checkRowIndex(tup[0])
             
-        return row[idx]
+        return self._toPython(idx, self._data[idx][row])
     
     
     def getColumn(self, key):
+        """ Return read-only view of the array holding column `key`. """
         
         idx = self._getColumnIndex(key)
-        col = [self.df[n][idx] for n in range(self.shape[0])]
+        self._materialize()
+        if self._data is None:
+            return np.array([])
+        col = self._data[idx][:self._len]
+        col.flags.writeable = False
             
         return col
     
@@ -165,48 +794,209 @@ class Data:
         return idx
     
                 
+    def _toStorage(self, idx, value):
+        """ Convert `value` to the type stored in column `idx`. """
+        return parse_value(self.kinds[idx], value)
+
+
+    def _toPython(self, idx, value):
+        """ Convert `value` from column `idx` to a Python object.
+
+            Dates are returned as 'YYYY-MM-DD' strings and durations as
+            'MM:SS' strings, as they appear in the csv file.
+        """
+        kind = self.kinds[idx]
+        if kind == 'duration':
+            return sec_to_minsec(value)
+        elif kind == 'date':
+            return str(value)
+        elif kind == 'int':
+            return int(value)
+        elif kind == 'float':
+            return float(value)
+        return value
+
+
+    def _formatItem(self, idx, value):
+        """ Format Python `value` from column `idx` for the csv file. """
+        if self.kinds[idx] == 'float':
+            return format_float(value)
+        return str(value)
+
+
+    def _ensureCapacity(self, size):
+        """ Grow the column buffers, if necessary, to hold `size` rows. """
+        capacity = len(self._data[0])
+        if size > capacity:
+            capacity = max(size, 2*capacity, 16)
+            for n, col in enumerate(self._data):
+                new = np.empty(capacity, dtype=col.dtype)
+                new[:self._len] = col[:self._len]
+                self._data[n] = new
+
+
     def addRow(self, row):
         """ Add new row to Data. """
+        idx = self._insertRow(self._len, row)
+        self._record('a', self._rowString(idx))
+        self._changed(RowAdded(idx, self.getRow(idx)))
+
+
+    def insertRow(self, idx, row):
+        """ Insert new row into Data before row `idx`. """
+        idx = self._insertRow(idx, row)
+        self._record('i', idx, self._rowString(idx))
+        self._changed(RowAdded(idx, self.getRow(idx)))
+
+
+    def _insertRow(self, idx, row):
+        """ Insert `row` before row `idx` and return its index. """
         
         if len(row) != self.shape[1]:
             raise ValueError('New row should have {} elements'
                              .format(self.shape[1]))
         else:
+            self._materialize()
+            if idx < 0:
+                idx += self._len
+            if not 0 <= idx <= self._len:
+                raise IndexError('Data index out of range')
             # if we started with an empty csv file, get the types now
-            if self.types is None:
-                self.types = self._get_types(row)
+            if self.kinds is None:
+                self.kinds = column_kinds(self.col_names,
+                                          [[item] for item in row])
+                self._data = [np.empty(0, dtype=kind_dtypes[kind])
+                              for kind in self.kinds]
             # type cast new row
-            row = [self.types[n](row[n]) for n in range(self.shape[1])]
-            self.df.append(row)
+            row = [self._toStorage(n, row[n]) for n in range(self.shape[1])]
+            self._ensureCapacity(self._len + 1)
+            for n, col in enumerate(self._data):
+                col[idx+1:self._len+1] = col[idx:self._len]
+                col[idx] = row[n]
+            self._len += 1
+            self._date_index = {}
+            self._stats = {}
+            if self._row_strings is not None:
+                self._row_strings.insert(idx, None)
             self.modified = True
+            return idx
         
         
     def removeRow(self, idx):
         """ Remove row from Data. """
+        self._materialize()
+        idx = self._checkRowIndex(idx)
+        values = self.getRow(idx)
+        for col in self._data:
+            col[idx:self._len-1] = col[idx+1:self._len]
+        self._len -= 1
+        self._date_index = {}
+        self._stats = {}
+        if self._row_strings is not None:
+            del self._row_strings[idx]
+        self.modified = True
+        self._record('r', idx)
+        self._changed(RowRemoved(idx, values))
+
+
+    def subscribe(self, callback):
+        """ Call `callback` whenever the data change.
+
+            `callback` is given a list of CellChanged, RowAdded and RowRemoved
+            records (see undo.py), in the order the changes were made.
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+
+    def unsubscribe(self, callback):
+        """ Stop calling `callback` when the data change. """
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+
+    def _changed(self, change):
+        """ Add `change` to the undo history and tell the listeners. """
+        self.history.record(change)
+        self._notify([change])
+
+
+    def _notify(self, changes):
+        """ Send list of `changes` to the listeners, or hold them until the
+            end of the current `undoGroup`.
+        """
+        if self._batch is not None:
+            self._batch.extend(changes)
+            return
+        for callback in list(self._listeners):
+            callback(changes)
+
+
+    @contextmanager
+    def _batchChanges(self):
+        """ Context manager which sends all changes to the listeners at once,
+            when it exits.
+        """
+        if self._batch is not None:
+            # already batching
+            yield
+            return
+        self._batch = []
         try:
-            del self.df[idx]
-            self.modified = True
-        except IndexError:
-            raise IndexError
-        
-    
-    def _get_types(self, row):
-        
-        # get type of each item in row
-        types = []
-        
-        for item in row:
-            try:
-                int(item)
-                types.append(int)
-            except ValueError:
-                try:
-                    float(item)
-                    types.append(float)
-                except ValueError:
-                    types.append(str)
-                
-        return tuple(types)
+            yield
+        finally:
+            changes, self._batch = self._batch, None
+            if changes:
+                self._notify(changes)
+
+
+    @contextmanager
+    def undoGroup(self):
+        """ Context manager in which all changes make one undo step, and are
+            sent to the listeners together.
+
+            For example
+
+            >>> with data.undoGroup():
+            ...     data.removeRow(3)
+            ...     data.removeRow(2)
+        """
+        with self.history.group(), self._batchChanges():
+            yield
+
+
+    def undo(self):
+        """ Undo the most recent step. Return False if there was none. """
+        if not self.history.canUndo():
+            return False
+        step = self.history.popUndo()
+        with self.history.paused(), self._batchChanges():
+            for diff in reversed(step):
+                if isinstance(diff, CellChanged):
+                    self[diff.row, diff.col] = diff.old
+                elif isinstance(diff, RowAdded):
+                    self.removeRow(diff.row)
+                elif isinstance(diff, RowRemoved):
+                    self.insertRow(diff.row, diff.values)
+        return True
+
+
+    def redo(self):
+        """ Redo the most recently undone step. Return False if there was
+            none.
+        """
+        if not self.history.canRedo():
+            return False
+        step = self.history.popRedo()
+        with self.history.paused(), self._batchChanges():
+            for diff in step:
+                if isinstance(diff, CellChanged):
+                    self[diff.row, diff.col] = diff.new
+                elif isinstance(diff, RowAdded):
+                    self.insertRow(diff.row, diff.values)
+                elif isinstance(diff, RowRemoved):
+                    self.removeRow(diff.row)
+        return True
     
     
     def setAlias(self, column, alias):
@@ -221,24 +1011,209 @@ class Data:
         self.aliases[idx] = alias
     
     
-    def where(self, column, condition, mode):
+    def where(self, condition, mode='idx'):
         """ Analyse Data object and return where a condition is met
         
             Parameters
             ----------
-            column : str or index
-                column to be analysed
-            condition : str
-                condition to be met (should evalute to True/False)
-                Please use 'data' to refer to the selected column
-            mode : {'idx', 'row'}
-                retun either the indices of rows where the condition is met
-                or the full row
+            condition : query.Condition
+                condition to be met, made from `query.Column` objects, e.g.
+                `Column('Gear').isin({5, 6}) & (Column('Distance (km)') > 20)`
+            mode : {'idx', 'row', 'mask'}
+                return either the indices of rows where the condition is met,
+                the full rows or a boolean array with an element for every
+                row. Default is 'idx'.
         """
         
-        pass
+        if len(self) == 0:
+            # the column types aren't known until the first row is added, so
+            # the values in the condition can't be converted
+            mask = np.zeros(0, dtype=bool)
+        else:
+            mask = condition.evaluate(self)
+
+        if mode == 'mask':
+            return mask
+
+        idx = np.flatnonzero(mask)
+        if mode == 'idx':
+            return idx
+        elif mode == 'row':
+            return [self.getRow(n) for n in idx]
+        else:
+            raise ValueError(f"Invalid mode '{mode}'")
+
+
+    def subset(self, rows):
+        """ Return new Data object holding only `rows`.
+
+            `rows` can be an array of row indices or a boolean mask, e.g.
+            from `where` or `dateRange`. The new object has no history,
+            journal or listeners and is not linked to a file, so it can't be
+            saved.
+        """
+        self._materialize()
+        if self._data is None:
+            columns = None
+        else:
+            columns = [col[:self._len][rows] for col in self._data]
+
+        new = Data.__new__(Data)
+        new.__dict__.update(self.__dict__)
+        new.modified = False
+        new.history = UndoStack(self.history.depth)
+        new._listeners = []
+        new._batch = None
+        new.journal = False
+        new._pending = []
+        new._journal_len = 0
+        new.cache = False
+        new.csvfile = None
+        new.journalfile = None
+        new._file_state = None
+        new.externally_modified = False
+        new.journal_conflict = False
+        new.readonly = True
+        new._setColumns(columns)
+        return new
+
+
+    def _dateIndex(self, column):
+        """ Return sorted dates in `column` and the order that sorts them.
+
+            If the dates are already in order, the order is None.
+        """
+        try:
+            return self._date_index[column]
+        except KeyError:
+            dates = self.getColumn(column)
+            if np.all(dates[1:] >= dates[:-1]):
+                index = (dates, None)
+            else:
+                order = np.argsort(dates, kind='stable')
+                index = (dates[order], order)
+            self._date_index[column] = index
+            return index
+
+
+    def dateRange(self, column='date', start=None, end=None, inclusive=True):
+        """ Return boolean array which is True for dates in range.
+
+            The range is found by bisection of the sorted dates.
+
+            Parameters
+            ----------
+            column : str or index
+                date column. Default is 'date'.
+            start, end : str or datetime64, optional
+                first and last dates in the range. If either is not given, the
+                range is open at that end.
+            inclusive : bool
+                if True (default), `start` and `end` are in the range.
+        """
+        column = self._getColumnIndex(column)
+        dates, order = self._dateIndex(column)
+
+        lo = 0
+        hi = len(dates)
+        if start is not None:
+            side = 'left' if inclusive else 'right'
+            lo = np.searchsorted(dates, np.datetime64(start, 'D'), side)
+        if end is not None:
+            side = 'right' if inclusive else 'left'
+            hi = np.searchsorted(dates, np.datetime64(end, 'D'), side)
+
+        mask = np.zeros(len(dates), dtype=bool)
+        if order is None:
+            mask[lo:hi] = True
+        else:
+            mask[order[lo:hi]] = True
+        return mask
     
     
+    def _columnStat(self, column, key, compute):
+        """ Return statistic `key` of `column`, calling `compute` with the
+            column array if it isn't cached.
+        """
+        idx = self._getColumnIndex(column)
+        stats = self._stats.setdefault(idx, {})
+        if key not in stats:
+            stats[key] = compute(idx, self.getColumn(idx))
+        return stats[key]
+
+
+    def unique(self, column):
+        """ Return sorted tuple of the distinct values in `column`.
+
+            This, `valueCounts`, `describe` and `histogram` are cached until
+            the column is changed.
+        """
+        return tuple(self.valueCounts(column))
+
+
+    def valueCounts(self, column):
+        """ Return dict of the number of times each value occurs in `column`,
+            in order of value.
+        """
+        def compute(idx, col):
+            values, counts = np.unique(col, return_counts=True)
+            return {self._toPython(idx, value): int(count)
+                    for value, count in zip(values, counts)}
+        return dict(self._columnStat(column, 'counts', compute))
+
+
+    def describe(self, column):
+        """ Return dict of the number of values in `column` and their minimum,
+            maximum and mean.
+
+            The mean is None for columns of strings. For dates and durations
+            it is rounded to the nearest day or second.
+        """
+        def compute(idx, col):
+            if len(col) == 0:
+                return {'count':0, 'min':None, 'max':None, 'mean':None}
+            kind = self.kinds[idx]
+            if kind == 'str':
+                mean = None
+            elif kind == 'date':
+                mean = np.datetime64(int(round(col.astype(np.int64).mean())),
+                                     'D')
+                mean = self._toPython(idx, mean)
+            elif kind == 'duration':
+                mean = self._toPython(idx, int(round(col.mean())))
+            else:
+                mean = float(col.mean())
+            return {'count':len(col), 'min':self._toPython(idx, col.min()),
+                    'max':self._toPython(idx, col.max()), 'mean':mean}
+        return dict(self._columnStat(column, 'describe', compute))
+
+
+    def histogram(self, column, bins=10, range=None):
+        """ Return counts and bin edges of the values in `column`.
+
+            Parameters
+            ----------
+            column : str or index
+                numeric, duration or date column. Dates are counted as days
+                since 1970-01-01 and durations in seconds.
+            bins : int
+                number of bins of equal width. Default is 10.
+            range : (float, float), optional
+                lower and upper edges of the bins. By default, the minimum
+                and maximum values.
+        """
+        def compute(idx, col):
+            if col.dtype.kind == 'M':
+                col = col.astype(np.int64)
+            counts, edges = np.histogram(col.astype(np.float64), bins=bins,
+                                         range=range)
+            counts.flags.writeable = False
+            edges.flags.writeable = False
+            return counts, edges
+        key = ('histogram', bins, None if range is None else tuple(range))
+        return self._columnStat(column, key, compute)
+
+
     def getMax(self, column, mode='row'):
         """ Find max in given column
         
@@ -251,7 +1226,7 @@ class Data:
                 Default is 'row'.
         """
         
-        return self._getMinMax(data.getColumn(column), max, mode)
+        return self._getMinMax(self.getColumn(column), np.argmax, mode)
         
     
     def getMin(self, column, mode='row'):
@@ -266,19 +1241,16 @@ class Data:
                 Default is 'row'.
         """
         
-        return self._getMinMax(data.getColumn(column), min, mode)
-        
-    @staticmethod
-    def _getMinMax(col, which, mode):
+        return self._getMinMax(self.getColumn(column), np.argmin, mode)
         
-        result = which(col)
+    def _getMinMax(self, col, which, mode):
         
-        idx = col.index(result)
+        idx = int(which(col))
         
         if mode == 'idx':
             return idx
         else:
-            return data[idx]
+            return self[idx]
         
         
 if __name__ == '__main__':
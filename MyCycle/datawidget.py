@@ -3,10 +3,19 @@ Make single widget containing personal best and csv data QTextEdits.
 This widget will be set as the main window's central widget.
 """
 
+from datetime import date
 from PyQt5.QtWidgets import (QTextEdit, QWidget, QVBoxLayout, QSizePolicy,
-                             QMessageBox)
-from processcsv import csv_to_html 
-from analysedata import get_best_session, get_best_month, get_best_days
+                             QMessageBox, QStackedWidget, QTableView,
+                             QHeaderView)
+from processcsv import data_to_html 
+from calendargroup import date_label
+from pbtracker import PBTracker, pb_columns
+from leaderboard import Leaderboard, metrics
+from rolling import DailyTotals, windows
+from undo import CellChanged
+
+# number of sessions in each column of the leaderboard
+leaderboard_size = 5
 
 
 def tag(tag, s, attr=''):
@@ -63,25 +72,95 @@ class DataWidget(QWidget):
         self.pb.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Minimum)
         self.ad.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
         
+        # the data can be shown as html or in a table; the table model is
+        # made when it is first needed
+        self.table = QTableView()
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.Stretch)
+        self.model = None
+
+        self.stack = QStackedWidget()
+        self.stack.addWidget(self.ad)
+        self.stack.addWidget(self.table)
+        self.stack.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
+
         layout.addWidget(self.pb)
-        layout.addWidget(self.ad)
+        layout.addWidget(self.stack)
         
         self.setLayout(layout)
         
+        # html of each month, so only changed months are rendered again
+        self.html_cache = {}
+        
+        # personal bests, updated with each change to the data
+        self.pbs = PBTracker(self.data)
+        self.leaders = Leaderboard(self.data, k=leaderboard_size)
+        self.rolling = DailyTotals.fromData(self.data, end=date.today())
         self.pb_session, _ = self.getPBsession()
         self.pb_month, _ = self.getPBmonth()
         self.pb_days, _ = self.getPBdays()
         
+        self.data.subscribe(self.dataChanged)
+
         
     def setHtml(self):
         """ Set text in both Personal Best and All CSV Data widgets. """
         if len(self.data) > 0:
             self.setCsvData()
             self.setPB()
+
+    def dataChanged(self, changes):
+        """ Update widgets after list of `changes` to the data.
+
+            The Personal Bests are only found again if a change could affect
+            them.
+        """
+        self.pbs.update(changes)
+        self.leaders.update(changes)
+        self.rolling.update(changes, self.data)
+        if len(self.data) == 0:
+            return
+        self.setCsvData()
+        if any(not isinstance(change, CellChanged)
+               or self.data.columns[change.col].lower() in pb_columns
+               for change in changes):
+            self.setPB()
         
+    def setTableView(self, table):
+        """ Show the data in a table if `table` is True, otherwise as html.
+        """
+        if table:
+            if self.model is None:
+                from tablemodel import MonthTableModel
+                self.model = MonthTableModel(self.data, self)
+                self.model.rowsInserted.connect(self._setSpans)
+                self.model.modelReset.connect(self._setSpans)
+                self.table.setModel(self.model)
+                self._setSpans()
+            self.stack.setCurrentWidget(self.table)
+        else:
+            self.stack.setCurrentWidget(self.ad)
+            self.setCsvData()
+
+    def _setSpans(self, parent=None, first=0, last=None):
+        """ Make month headers in table rows `first` to `last` span every
+            column.
+        """
+        if last is None:
+            # model was reset
+            self.table.clearSpans()
+            last = self.model.rowCount() - 1
+        for row in range(first, last+1):
+            if self.model.isHeader(row):
+                self.table.setSpan(row, 0, 1, self.model.columnCount())
+
     def setCsvData(self):
         # set csv data QTextEdit
-        ad_text = csv_to_html(str(self.data))
+        # the table updates itself, so the html is only needed when shown
+        if self.stack.currentWidget() is not self.ad:
+            return
+        ad_text = data_to_html(self.data, self.html_cache)
         self.ad.setHtml(ad_text)
         
     def setPB(self):
@@ -92,9 +171,8 @@ class DataWidget(QWidget):
     def getPB(self):
         # get all Personal Best data
         
-        # TODO get longest, farthest and fastest PBs
-        # then also can have methods to make the verbose strings, which can 
-        # also be used be the message box
+        # TODO methods to make the verbose strings, which can also be used
+        # by the message box
         pb_session, pb_session_text = self.getPBsession()
         pb_month, pb_month_text = self.getPBmonth()
         pb_days, pb_days_text = self.getPBdays()
@@ -102,6 +180,8 @@ class DataWidget(QWidget):
         text = '\n' + header('Best Session:') + body(pb_session_text)
         text += header('Best Month:') + body(pb_month_text) 
         text += header('Longest streak:') + body(pb_days_text)
+        text += header('Top sessions:') + self.getLeaderboard()
+        text += header('Rolling totals:') + self.getRolling()
         
         self._comparePB(pb_session, pb_month, pb_days)
         
@@ -136,7 +216,7 @@ class DataWidget(QWidget):
         
     def getPBsession(self):
         # get best session
-        best, when = get_best_session(self.data)
+        best, when = self.pbs.bestSession()
         text = bold('{:.3f} km/h'.format(best))
         text += ' achieved on {}'.format(when)
         
@@ -144,7 +224,7 @@ class DataWidget(QWidget):
     
     def getPBmonth(self):
         # get best month
-        best, when, time, cal = get_best_month(self.data)
+        best, when, time, cal = self.pbs.bestMonth()
         text = f'{when}: '
         text += bold(f' {best:.2f} km') 
         text += ', total time: ' + bold(time) 
@@ -152,8 +232,59 @@ class DataWidget(QWidget):
         
         return best, text
     
+    def getLeaderboard(self):
+        # table of the best sessions by speed, distance, time and calories
+        titles = {'speed':'Fastest', 'distance':'Farthest',
+                  'duration':'Longest', 'calories':'Most calories'}
+        tops = [self.leaders.top(metric) for metric in metrics]
+        rows = [''.join(tag('th', titles[metric]) for metric in metrics)]
+        for n in range(leaderboard_size):
+            cells = []
+            for metric, top in zip(metrics, tops):
+                if n < len(top):
+                    text = self._leaderText(metric, *top[n])
+                else:
+                    text = ''
+                cells.append(tag('td', text))
+            rows.append(''.join(cells))
+        rows = ''.join(tag('tr', row) for row in rows)
+        return tag('table', rows, 'width="100%"')
+
+    def _leaderText(self, metric, value, session):
+        # value of `metric` for `session` and its date
+        if metric == 'speed':
+            text = f'{value:.2f} km/h'
+        elif metric == 'distance':
+            text = f'{value:.2f} km'
+        elif metric == 'duration':
+            text = session.time
+        else:
+            text = f'{value:.2f} cal'
+        return bold(text) + f' ({date_label(session.date, short=True)})'
+
+    def getRolling(self):
+        # distance and speed over the last 7, 30 and 365 days, and the
+        # greatest distance over that many days
+        totals = self.rolling
+        totals.extend(date.today())
+        titles = ['', 'Distance', 'Avg. speed', 'Best distance']
+        rows = [''.join(tag('th', title) for title in titles)]
+        for window in windows:
+            _, dist, _, speed = totals.latest(window)
+            best, end = totals.best('distance (km)', window)
+            cells = [f'Last {window} days', bold(f'{dist:.2f} km'),
+                     bold(f'{speed:.2f} km/h')]
+            if end is None:
+                cells.append('')
+            else:
+                cells.append(bold(f'{best:.2f} km')
+                             + f' (to {date_label(end, short=True)})')
+            rows.append(''.join(tag('td', cell) for cell in cells))
+        rows = ''.join(tag('tr', row) for row in rows)
+        return tag('table', rows, 'width="100%"')
+
     def getPBdays(self):
-        best, first, last = get_best_days(self.data)
+        best, first, last = self.pbs.bestDays()
         text = bold(f'{best} days') 
         text += f', from {first} to {last}'
         return best, text
\ No newline at end of file
@@ -8,8 +8,9 @@ from PyQt5.QtWidgets import (QAbstractItemView, QAction, QDialog,
                              QDialogButtonBox, QGridLayout, QGroupBox, 
                              QHBoxLayout, QLabel, QLineEdit, 
                              QMessageBox, QPushButton, QTableWidget, 
-                             QTableWidgetItem, QVBoxLayout)
+                             QTableWidgetItem, QVBoxLayout, QCompleter)
 from metaclass import QtABCMeta
+from schema import format_float
 
 from str_to_date import str_to_date
 from format_dur import format_duration
@@ -137,6 +138,12 @@ class AddLineDialog(QDialog_CTRL_Q):
         edits = list(QLineEdit(self) for n in range(self.ncols))
         # set today's set in the Date column
         edits[0].setText(str_to_date('').strftime(datefmt))
+        # suggest values already used for gear and weight
+        for n, name in enumerate(self.data.columns):
+            if name.lower() in ['gear', 'weight (kg)'] and len(self.data) > 0:
+                values = [format_float(v) if isinstance(v, float) else str(v)
+                          for v in self.data.unique(name)]
+                edits[n].setCompleter(QCompleter(values, edits[n]))
         return tuple(edits)
 
     def addLine(self):
@@ -188,8 +195,10 @@ class AddLineDialog(QDialog_CTRL_Q):
                 self.empty_value_message(line)
                     
         if not error:
-            for row in new_rows:
-                self.data.addRow(row)
+            # all new rows can be undone in one step
+            with self.data.undoGroup():
+                for row in new_rows:
+                    self.data.addRow(row)
             self.accept()
             
     @staticmethod
@@ -306,8 +315,8 @@ class RemoveLineDialog(TableLineDiaolg):
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         
         self.explain.setText('Select rows and click "OK" to remove them from '
-                             'the csv file.\nThis cannot be undone, so please '
-                             'be careful!')
+                             'the csv file.\nThey can be restored with '
+                             '"Undo".')
         
         self.setWindowTitle('Remove entries')
         
@@ -319,9 +328,10 @@ class RemoveLineDialog(TableLineDiaolg):
         rows = list(set(item.row() for item in self.selected))
         rows.sort()
         
-        for idx in rows:
-            idx = self.nrows - idx - 1
-            self.data.removeRow(idx)
+        with self.data.undoGroup():
+            for idx in rows:
+                idx = self.nrows - idx - 1
+                self.data.removeRow(idx)
 
         self.accept()
         
@@ -345,7 +355,13 @@ class EditLineDialog(TableLineDiaolg):
 
     def apply_changes(self):
         # check every item in the table against the csv data 
+        # all edits can be undone in one step
+        with self.data.undoGroup():
+            self._apply_edits()
         
+        self.accept()
+
+    def _apply_edits(self):
         for row in range(self.nrows):
             for col in range(self.ncols):
                 item = self.table.item(row, col)
@@ -367,5 +383,3 @@ class EditLineDialog(TableLineDiaolg):
                     if t != d:
                         self.data[df_row, col] = t
                     
-        self.accept()
-        
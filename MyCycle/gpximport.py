@@ -0,0 +1,266 @@
+"""
+Import rides from GPX files
+
+Every GPX file in a directory is read in a pool of processes. For each file,
+the date, moving time and distance are found from the trackpoints, then each
+ride is inserted into the Data object at its date, with the odometer carried
+on from the session before it.
+
+Files can also be imported from the command line:
+
+    python gpximport.py directory [csvfile]
+"""
+
+import argparse
+import glob
+import os.path
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+import numpy as np
+from format_dur import format_duration
+from schema import sec_to_minsec
+
+# mean radius of the Earth, in km
+earth_radius = 6371.0088
+# slower than this (in km/h) between two trackpoints is not moving
+min_speed = 2.0
+# a gap between trackpoints longer than this (in seconds) is a pause
+max_gap = 300
+
+
+def haversine(lat, lon):
+    """ Return array of distances (in km) between consecutive points.
+
+        Parameters
+        ----------
+        lat, lon : arrays of latitude and longitude, in degrees
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = (np.sin(dlat/2)**2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon/2)**2)
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def _parse_times(values):
+    """ Convert list of ISO 8601 strings to array of datetime64[ms] (UTC). """
+    try:
+        return np.array([v[:-1] if v.endswith('Z') else v for v in values],
+                        dtype='datetime64[ms]')
+    except ValueError:
+        # times with a UTC offset
+        times = [datetime.fromisoformat(v.replace('Z', '+00:00'))
+                 for v in values]
+        times = [t.timestamp() * 1000 for t in times]
+        return np.array(times, dtype=np.int64).astype('datetime64[ms]')
+
+
+def read_trackpoints(fname):
+    """ Return arrays of time, latitude, longitude and elevation of every
+        trackpoint in GPX file `fname`.
+
+        Elevation is NaN where a trackpoint has none.
+    """
+    root = ET.parse(fname).getroot()
+    points = root.findall('.//{*}trkpt')
+    if not points:
+        # files exported as routes have no track
+        points = root.findall('.//{*}rtept')
+
+    lat = np.array([pt.get('lat') for pt in points], dtype=np.float64)
+    lon = np.array([pt.get('lon') for pt in points], dtype=np.float64)
+    times = [pt.findtext('{*}time') for pt in points]
+    ele = [pt.findtext('{*}ele') for pt in points]
+    ele = np.array([np.nan if e is None else e for e in ele],
+                   dtype=np.float64)
+
+    if any(t is None for t in times):
+        raise ValueError(f"'{fname}' has trackpoints without a time")
+    times = _parse_times(times)
+
+    return times, lat, lon, ele
+
+
+def summarise_ride(times, lat, lon):
+    """ Return date, moving time (in seconds) and distance (in km) of a ride.
+
+        Time between two trackpoints only counts as moving if the speed
+        between them is at least `min_speed` and they are no more than
+        `max_gap` seconds apart.
+    """
+    dist = haversine(lat, lon)
+    dt = np.diff(times).astype(np.int64) / 1000
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = 3600 * dist / dt
+    moving = (dt > 0) & (dt <= max_gap) & (speed >= min_speed)
+    date = str(times[0].astype('datetime64[D]'))
+    return date, int(round(dt[moving].sum())), float(dist.sum())
+
+
+def read_gpx(fname, points=False):
+    """ Return (date, seconds, distance) for GPX file `fname`, or None if it
+        can't be read or has fewer than two trackpoints.
+
+        If `points` is True, the arrays from `read_trackpoints` are also
+        returned, as a fourth item.
+    """
+    try:
+        trackpoints = read_trackpoints(fname)
+    except (ET.ParseError, OSError, ValueError):
+        return None
+    times, lat, lon, _ = trackpoints
+    if len(times) < 2:
+        return None
+    ride = summarise_ride(times, lat, lon)
+    if points:
+        ride += (trackpoints,)
+    return ride
+
+
+def import_gpx(data, path, callback=None, workers=None, defaults=None,
+               tracks=None):
+    """ Add a session to `data` for every GPX file in directory `path`.
+
+        Parameters
+        ----------
+        data : Data object
+        path : str
+            directory of GPX files
+        callback : callable, optional
+            called with the number of files read and the total number of
+            files as each file is read. If it returns False, the import is
+            cancelled and nothing is added.
+        workers : int, optional
+            number of processes. Default is the number of CPUs.
+        defaults : dict, optional
+            values for columns which can't be found from a GPX file, by
+            lower case column name. By default calories are 0 and the gear
+            and weight are those of the last session. The odometer is that
+            of the session before each ride plus the ride's distance; the
+            'odometer (km)' value here is only used for rides before every
+            other session (default 0).
+        tracks : TrackStore, optional
+            if given, the trackpoints of each ride are added to it.
+
+        Returns
+        -------
+        num : int
+            number of sessions added
+        failed : list
+            files that couldn't be read
+    """
+    files = sorted(set(glob.glob(os.path.join(path, '*.gpx'))
+                       + glob.glob(os.path.join(path, '*.GPX'))))
+    total = len(files)
+
+    rides = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        read = partial(read_gpx, points=tracks is not None)
+        results = pool.map(read, files, chunksize=max(1, total // 64))
+        for n, (fname, ride) in enumerate(zip(files, results)):
+            if ride is None:
+                failed.append(fname)
+            else:
+                rides.append(ride)
+            if callback is not None and callback(n+1, total) is False:
+                pool.shutdown(cancel_futures=True)
+                return 0, failed
+
+    if not rides:
+        return 0, failed
+
+    # in order of date, then distance
+    rides.sort(key=lambda ride: ride[:3])
+    dates, secs, dist = ([ride[n] for ride in rides] for n in range(3))
+    dist = np.round(dist, 2)
+
+    values = _defaults(data)
+    if defaults is not None:
+        values.update({key.lower(): value for key, value in defaults.items()})
+    odo = values.get('odometer (km)', 0)
+
+    # the session before each ride by date, found from the data as they
+    # are now, which may not be in date order; rides on the same day as a
+    # session go after it
+    dates = np.array(dates, dtype='datetime64[D]')
+    if len(data) > 0:
+        order = np.argsort(data.getColumn('date'), kind='stable')
+        sorted_dates = data.getColumn('date')[order]
+        num = np.searchsorted(sorted_dates, dates, side='right')
+        prev = order[np.maximum(num - 1, 0)]
+        # each ride goes after that session, or before the earliest session
+        pos = np.where(num > 0, prev + 1, order[0])
+    else:
+        num = prev = pos = np.zeros(len(dates), dtype=np.int64)
+
+    odos = []
+    for n in range(len(dates)):
+        if n > 0 and num[n] == num[n-1]:
+            # no session between this ride and the one before it
+            odos.append(round(odos[-1] + dist[n], 2))
+        elif num[n] > 0 and 'odometer (km)' in values:
+            odos.append(round(data[int(prev[n]), 'odometer (km)'] + dist[n], 2))
+        else:
+            odos.append(round(odo + dist[n], 2))
+
+    with data.undoGroup():
+        # in order of where they go, so each ride only moves the rows after
+        # it; rides going at the same row stay in date order
+        for m, n in enumerate(np.argsort(pos, kind='stable')):
+            idx = int(pos[n]) + m
+            values.update({'date':str(dates[n]),
+                           'time':format_duration(sec_to_minsec(secs[n])),
+                           'distance (km)':dist[n]})
+            if 'odometer (km)' in values:
+                values['odometer (km)'] = odos[n]
+            data.insertRow(idx, [values[name.lower()] for name in data.columns])
+            if tracks is not None:
+                tracks.add(*rides[n][3], time=secs[n], dist=dist[n])
+
+    return len(dates), failed
+
+
+def _defaults(data):
+    """ Return dict of values for columns not found from GPX files. """
+    values = {name.lower(): 0 for name in data.columns}
+    if len(data) > 0:
+        last = data.getRow(-1)
+        for name, value in zip(data.columns, last):
+            if name.lower() in ['gear', 'weight (kg)']:
+                values[name.lower()] = value
+    return values
+
+
+if __name__ == '__main__':
+
+    from dataobject import Data
+    from trackstore import TrackStore
+
+    home = os.path.expanduser('~')
+
+    parser = argparse.ArgumentParser(description='Import GPX files into '
+                                                 'MyCycle.')
+    parser.add_argument('directory')
+    parser.add_argument('csvfile', nargs='?',
+                        default=os.path.join(home, '.mycycle', 'mycycle.csv'))
+    parser.add_argument('--tracks', action='store_true',
+                        help='also keep the trackpoints of each ride')
+    args = parser.parse_args()
+
+    def progress(n, total):
+        print(f'\r{n}/{total}', end='', flush=True)
+
+    data = Data(args.csvfile)
+    tracks = TrackStore(args.csvfile) if args.tracks else None
+    num, failed = import_gpx(data, args.directory, callback=progress,
+                             tracks=tracks)
+    print()
+    data.save()
+    print(f'Added {num} sessions')
+    for fname in failed:
+        print(f"Couldn't read '{fname}'")
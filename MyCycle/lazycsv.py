@@ -0,0 +1,90 @@
+"""
+Memory-mapped csv file, with rows parsed on demand
+"""
+
+import mmap
+import numpy as np
+
+
+class LazyCsv:
+
+    def __init__(self, fname, parse=None):
+        """ Read-only view of a csv file, which is memory-mapped and indexed
+            by line start offsets in a single pass. Rows are only parsed when
+            they are accessed, and are then cached.
+
+            Parameters
+            ----------
+            fname : str
+                path to csv file
+            parse : callable, optional
+                function which takes a row as a list of strings and returns
+                the parsed row. If not given, the list of strings is returned.
+        """
+
+        self.parse = parse
+        self._cache = {}
+
+        with open(fname, 'rb') as fileobj:
+            self._mm = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # find start and end of every line
+        buf = np.frombuffer(self._mm, dtype=np.uint8)
+        ends = np.flatnonzero(buf == ord('\n'))
+        if len(buf) > 0 and buf[-1] != ord('\n'):
+            ends = np.append(ends, len(buf))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        del buf
+
+        # ignore empty lines
+        nonempty = ends > starts
+        dtype = np.uint32 if len(self._mm) < 2**32 else np.int64
+        starts = starts[nonempty].astype(dtype)
+        ends = ends[nonempty].astype(dtype)
+
+        # first line contains the column names
+        self.header = self._getLine(starts[0], ends[0])
+        self._starts = starts[1:]
+        self._ends = ends[1:]
+
+
+    def __len__(self):
+        return len(self._starts)
+
+
+    def __getitem__(self, idx):
+        """ Return parsed row `idx`. """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('LazyCsv index out of range')
+
+        try:
+            return self._cache[idx]
+        except KeyError:
+            row = self.fields(idx)
+            if self.parse is not None:
+                row = self.parse(row)
+            self._cache[idx] = row
+            return row
+
+
+    def fields(self, idx):
+        """ Return row `idx` as list of strings, without parsing or caching.
+        """
+        return self._getLine(self._starts[idx], self._ends[idx])
+
+
+    def _getLine(self, start, end):
+        """ Return line between byte offsets as list of strings. """
+        return self._mm[int(start):int(end)].decode().split(',')
+
+
+    def text(self):
+        """ Return the whole file as a string. """
+        return self._mm[:].decode()
+
+
+    def close(self):
+        self._cache = {}
+        self._mm.close()
@@ -0,0 +1,143 @@
+"""
+The best sessions by average speed, distance, duration and calories
+
+For each of these, the top `k` sessions are kept in a min-heap of size `k`,
+so a new session only has to be compared with the smallest of them. When
+one of the top sessions is removed, that ranking is found again from the
+columns, with a vectorized sort, as are all of them when a session is edited
+or the data are reloaded. Sessions with no time have no average speed, so
+are left out of the ranking by speed.
+"""
+
+import heapq
+from collections import namedtuple
+import numpy as np
+from analysedata import avg_speed
+from schema import minsec_to_sec, sec_to_minsec, session_columns
+from undo import CellChanged, RowAdded, RowRemoved, Reloaded
+
+# ways of ranking sessions
+metrics = ['speed', 'distance', 'duration', 'calories']
+
+# columns used by the rankings
+columns = session_columns
+
+Session = namedtuple('Session', ['date', 'time', 'distance', 'calories'])
+
+
+def _values(metric, time, dist, cal):
+    """ Return value of `metric` for arrays of `time` (in seconds),
+        `dist` and `cal`, or NaN for sessions which can't be ranked.
+    """
+    if metric == 'speed':
+        return avg_speed(time, dist)
+    elif metric == 'distance':
+        return dist
+    elif metric == 'duration':
+        return time
+    elif metric == 'calories':
+        return cal
+    raise ValueError(f"'metric' should be one of {', '.join(metrics)}, not "
+                     f"'{metric}'")
+
+
+class Leaderboard:
+
+    def __init__(self, data, k=10):
+        """ Top `k` sessions of Data object `data` by each of `metrics`.
+
+            Call `update` with each list of changes sent by `data`. Sessions
+            with the same value are ranked by date, earliest first.
+        """
+        self.data = data
+        self.k = k
+        self.build()
+
+    def build(self, metric=None):
+        """ Find the top sessions by `metric` (by default, every metric) from
+            the columns of the data.
+        """
+        if metric is None:
+            self._heaps = {}
+            for metric in metrics:
+                self.build(metric)
+            return
+
+        num = len(self.data)
+        if num == 0:
+            self._heaps[metric] = []
+            return
+        dates, time, dist, cal = (self.data.getColumn(name)
+                                  for name in columns)
+        time = time.astype(np.float64)
+        dist = dist.astype(np.float64)
+        cal = cal.astype(np.float64)
+        values = _values(metric, time, dist, cal)
+
+        # greatest values first, then earliest dates
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        ranked = np.flatnonzero(~np.isnan(values))
+        top = ranked[np.lexsort((days[ranked], -values[ranked]))][:self.k]
+
+        heap = [(float(values[n]), -int(days[n]),
+                 Session(str(dates[n]), sec_to_minsec(time[n]),
+                         float(dist[n]), float(cal[n])))
+                for n in top.tolist()]
+        heapq.heapify(heap)
+        self._heaps[metric] = heap
+
+    def update(self, changes):
+        """ Update the rankings after list of `changes` to the data. """
+        if any(isinstance(change, Reloaded)
+               or (isinstance(change, CellChanged)
+                   and self.data.columns[change.col].lower() in columns)
+               for change in changes):
+            # edits are rare, so everything is found again
+            self.build()
+            return
+
+        rebuild = set()
+        for change in changes:
+            if isinstance(change, RowAdded):
+                self._push(self._session(change.values))
+            elif isinstance(change, RowRemoved):
+                rebuild |= self._holding(self._session(change.values))
+        for metric in rebuild:
+            self.build(metric)
+
+    def _session(self, values):
+        """ Return Session for list of `values` of a row. """
+        date, time, dist, cal = (values[self.data.aliases.index(name)]
+                                 for name in columns)
+        return Session(str(date), sec_to_minsec(minsec_to_sec(time)),
+                       float(dist), float(cal))
+
+    def _holding(self, session):
+        """ Return set of metrics whose top sessions include `session`. """
+        return {metric for metric, heap in self._heaps.items()
+                if any(item[2] == session for item in heap)}
+
+    def _push(self, session):
+        """ Add `session` to the rankings. """
+        time = np.float64(minsec_to_sec(session.time))
+        day = int(np.datetime64(session.date, 'D').astype(np.int64))
+        for metric, heap in self._heaps.items():
+            value = float(_values(metric, time, np.float64(session.distance),
+                                  np.float64(session.calories)))
+            if np.isnan(value):
+                continue
+            item = (value, -day, session)
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    def top(self, metric, n=None):
+        """ Return list of (value, Session) of the top `n` (by default, `k`)
+            sessions by `metric`, best first.
+        """
+        if metric not in self._heaps:
+            raise ValueError(f"'metric' should be one of {', '.join(metrics)}, "
+                             f"not '{metric}'")
+        items = sorted(self._heaps[metric], reverse=True)[:n]
+        return [(value, session) for value, _, session in items]
@@ -2,18 +2,30 @@
 # -*- coding: utf-8 -*-
 """
 Edit my cycling data
+
+Only what is needed to show the window is imported at startup. The plot
+(and Matplotlib), the edit dialogs and the GPX import are imported when they
+are first used. Run with --startup-time to print how long the window took to
+appear.
 """
 
+import time
+# when startup began, for --startup-time
+start_time = time.perf_counter()
+
+import argparse
 import sys
 import os.path
 from PyQt5.QtGui import QIcon, QKeySequence
 from PyQt5.QtWidgets import (QAction, QDesktopWidget, QMainWindow, QMessageBox, 
-                             QApplication)
-from PyQt5.QtCore import pyqtSlot as Slot
-from dataobject import Data
+                             QApplication, QFileDialog, QProgressDialog)
+from PyQt5.QtCore import QTimer, pyqtSlot as Slot
+from dataobject import CsvChangedError
+from report import open_data
 from datawidget import DataWidget
-from editdialogs import AddLineDialog, RemoveLineDialog, EditLineDialog
-from plotdialog import PlotDialog
+
+# when the modules above had been imported
+import_time = time.perf_counter()
 
 home = os.path.expanduser('~')
     
@@ -25,29 +37,42 @@ class MyCycle(QMainWindow):
         
     def initUI(self):
 
-        self.data = Data(os.path.join(home, '.mycycle', 'mycycle.csv'))
+        # use the SQLite database, if the csv has been migrated to one, or
+        # the yearly shards, if the csv has been split
+        self.data = open_data(os.path.join(home, '.mycycle'))
+        # trackpoints of imported rides, made on the first import
+        self.tracks = None
 
         # central widget is two QTextEdits - personal best and all csv data
         self.cw = DataWidget(self.data)
         
         self.setCentralWidget(self.cw)
         
-        # display text (as html)
-        self.update_display()
-        
         self.createActions()
         self.createMenus()
         self.createToolBars()
         
         self.statusBar()
         self.statTimeout = 1000
+
+        # display text (as html)
+        self.update_display()
         
+        # the widgets update themselves when the data change
+        self.data.subscribe(self.dataChanged)
+
+        # check for changes made to the file by other programs
+        self.fileTimer = QTimer(self, interval=2000, timeout=self.checkFile)
+        self.fileTimer.start()
+
         self.setWindowIcon(QIcon(''))  
         self.setWindowTitle('MyCycle')
         self.resize(700, 700)
         self.centre()
         
         self.show()
+
+        self.resolveJournal()
         
     def centre(self):
         """ Centre window on screen. """
@@ -60,13 +85,58 @@ class MyCycle(QMainWindow):
     def update_display(self):
         """ Update text and window title """
         self.cw.setHtml()
-        if self.data.modified:
-            self.statusBar().showMessage('Updated', self.statTimeout)
+        self.updateActions()
+
+    def dataChanged(self, changes):
+        """ Show status message and update actions when the data change. """
+        self.statusBar().showMessage('Updated', self.statTimeout)
+        self.updateActions()
+
+    def updateActions(self):
+        """ Enable undo and redo actions if there is something to undo or
+            redo.
+        """
+        self.undoAct.setEnabled(self.data.history.canUndo())
+        self.redoAct.setEnabled(self.data.history.canRedo())
+
+    def importGpx(self):
+        """ Add sessions from a directory of GPX files. """
+        path = QFileDialog.getExistingDirectory(self, 'Import GPX files', home)
+        if not path:
+            return
+
+        from gpximport import import_gpx
+        from trackstore import TrackStore
+
+        progress = QProgressDialog('Reading GPX files...', 'Cancel', 0, 0,
+                                   self)
+        progress.setWindowTitle('Import GPX')
+        progress.setMinimumDuration(500)
+
+        def update(num, total):
+            progress.setMaximum(total)
+            progress.setValue(num)
+            return not progress.wasCanceled()
+
+        if self.tracks is None:
+            # so that undoing the import also removes the trackpoints
+            self.tracks = TrackStore(self.data.csvfile)
+            self.tracks.follow(self.data)
+        num, failed = import_gpx(self.data, path, callback=update,
+                                 tracks=self.tracks)
+        progress.close()
+
+        text = f'Added {num} sessions.'
+        if failed:
+            text += f"\nCouldn't read {len(failed)} files."
+        QMessageBox.information(self, 'Import GPX', text)
             
     def plotData(self):
         """ Plot graph. """
+        # Matplotlib is only imported when the data are first plotted
+        from plotdialog import PlotDialog
         scheme = self.getColourScheme()
-        self.pld = PlotDialog(self.data, scheme)
+        self.pld = PlotDialog(self.data, scheme, totals=self.cw.rolling)
         self.pld.show()
         
     def getColourScheme(self):
@@ -81,25 +151,80 @@ class MyCycle(QMainWindow):
             
     def addLine(self):
         """ Add line(s) to csv. """
+        from editdialogs import AddLineDialog
         self.ald = AddLineDialog(self.data, self.data.columns)
         self.ald.show()
-        self.ald.accepted.connect(self.update_display)
         
     def removeLine(self):
         """ Remove line(s) from csv. """
+        from editdialogs import RemoveLineDialog
         self.rld = RemoveLineDialog(self.data)
         self.rld.show()
-        self.rld.accepted.connect(self.update_display)
             
     def editEntries(self):
         """ Edit csv data. """
+        from editdialogs import EditLineDialog
         self.ed = EditLineDialog(self.data)
         self.ed.show()
-        self.ed.accepted.connect(self.update_display)
+
+    def undo(self):
+        """ Undo last change to the data. """
+        self.data.undo()
+
+    def redo(self):
+        """ Redo last undone change to the data. """
+        self.data.redo()
+
+    @Slot()
+    def checkFile(self):
+        """ Read rows added to the file by other programs. If the file was
+            changed in a way that can't be merged, ask whether to reload it.
+        """
+        warned = self.data.externally_modified
+        self.data.checkFile()
+        if self.data.externally_modified and not warned:
+            msg = ("The data have been changed by another program.\n"
+                   "Reload them? Any changes you haven't saved will be lost.")
+            reply = QMessageBox.question(self, "Data changed", msg)
+            if reply == QMessageBox.Yes:
+                self.data.reload()
+                self.resolveJournal()
+
+    def resolveJournal(self):
+        """ If the journal of saved changes doesn't match the csv, ask
+            whether to apply it anyway or set it aside.
+        """
+        if not self.data.journal_conflict:
+            return
+        msg = ("Changes saved in {0} were made to an earlier version of {1}, "
+               "which has since been changed by another program.\n"
+               "Apply them to {1} as it is now? If not, they will be kept in "
+               "{0}.old.".format(os.path.basename(self.data.journalfile),
+                                 os.path.basename(self.data.csvfile)))
+        reply = QMessageBox.question(self, "Saved changes", msg)
+        if reply == QMessageBox.Yes:
+            try:
+                self.data.applyJournal()
+                return
+            except (ValueError, IndexError):
+                msg = ("The changes don't fit the data as they are now, so "
+                       "they will be kept in {}.old."
+                       .format(os.path.basename(self.data.journalfile)))
+                QMessageBox.warning(self, "Saved changes", msg)
+        self.data.discardJournal()
 
     def save(self):
         # use Data's save method
-        if self.data.save():
+        try:
+            saved = self.data.save()
+        except CsvChangedError:
+            msg = ("The data have been changed by another program.\n"
+                   "Overwrite those changes with yours?")
+            reply = QMessageBox.question(self, "Data changed", msg)
+            if reply != QMessageBox.Yes:
+                return
+            saved = self.data.save(force=True)
+        if saved:
             self.statusBar().showMessage('Saved', self.statTimeout)
             
     def closeEvent(self, event):
@@ -121,6 +246,11 @@ class MyCycle(QMainWindow):
                                statusTip="Exit the application", 
                                triggered=self.close)
         
+        self.importAct = QAction(QIcon.fromTheme('document-import'),
+                                 "&Import GPX...", self,
+                                 statusTip="Add sessions from GPX files",
+                                 triggered=self.importGpx)
+
         self.plotAct = QAction(QIcon.fromTheme('image-x-generic'), "&Plot",  
                                self, shortcut=QKeySequence("P"), 
                                statusTip="Plot the data", 
@@ -144,20 +274,42 @@ class MyCycle(QMainWindow):
                                shortcut="Ctrl+E", statusTip="Edit data",
                                triggered=self.editEntries)
 
+        self.tableAct = QAction("&Table view", self, checkable=True,
+                                shortcut="Ctrl+T",
+                                statusTip="Show the data in a table",
+                                toggled=self.cw.setTableView)
+
+        self.undoAct = QAction(QIcon.fromTheme('edit-undo'), "&Undo", self,
+                               shortcut=QKeySequence.Undo,
+                               statusTip="Undo the last change",
+                               triggered=self.undo)
+
+        self.redoAct = QAction(QIcon.fromTheme('edit-redo'), "&Redo", self,
+                               shortcut=QKeySequence.Redo,
+                               statusTip="Redo the last undone change",
+                               triggered=self.redo)
+
 
     def createMenus(self):
         
         self.fileMenu = self.menuBar().addMenu("&File")
         self.fileMenu.addAction(self.saveAct)
         self.fileMenu.addAction(self.plotAct)
+        self.fileMenu.addAction(self.importAct)
         self.fileMenu.addSeparator();
         self.fileMenu.addAction(self.exitAct)
         
         self.editMenu = self.menuBar().addMenu("&Edit")
+        self.editMenu.addAction(self.undoAct)
+        self.editMenu.addAction(self.redoAct)
+        self.editMenu.addSeparator()
         self.editMenu.addAction(self.addAct)
         self.editMenu.addAction(self.rmvAct)
         self.editMenu.addAction(self.editAct)
 
+        self.viewMenu = self.menuBar().addMenu("&View")
+        self.viewMenu.addAction(self.tableAct)
+
         self.menuBar().addSeparator()
 
         self.helpMenu = self.menuBar().addMenu("&Help")
@@ -172,9 +324,30 @@ class MyCycle(QMainWindow):
         
         self.editToolBar = self.addToolBar("Edit")
         self.editToolBar.addAction(self.addAct)
+        self.editToolBar.addAction(self.undoAct)
+        self.editToolBar.addAction(self.redoAct)
     
     
+def print_startup_time():
+    """ Print time taken to import the modules and to show the window. """
+    now = time.perf_counter()
+    print(f'Imports: {1000*(import_time-start_time):.0f} ms, '
+          f'first window: {1000*(now-start_time):.0f} ms', file=sys.stderr)
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+
+    parser = argparse.ArgumentParser(description='Edit and plot my cycling '
+                                                 'stats.')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='print the time taken to show the window')
+    # any other arguments are for Qt
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     window = MyCycle()
+    if args.startup_time:
+        # runs as soon as the event loop has started, after the window is
+        # first drawn
+        QTimer.singleShot(0, print_startup_time)
     sys.exit(app.exec_())
\ No newline at end of file
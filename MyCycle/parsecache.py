@@ -0,0 +1,151 @@
+"""
+Binary cache of the parsed csv data, stored alongside the csv file.
+
+The cache holds the typed columns and the kind of each column, and is only
+used if the size, modification time and a hash of the csv match those stored
+in the cache.
+
+The cache can be rebuilt or dropped from the command line:
+
+    python parsecache.py rebuild [csvfile]
+    python parsecache.py drop [csvfile]
+"""
+
+import argparse
+import hashlib
+import os
+import numpy as np
+from schema import schema
+
+# number of bytes from the start and end of the file used in the hash
+hash_block = 1 << 20
+
+
+def cache_path(csvfile):
+    """ Return path of the cache for `csvfile`. """
+    return csvfile + '.cache'
+
+
+def signature(csvfile):
+    """ Return array of size, modification time and hash of `csvfile`.
+
+        The hash is taken over the first and last `hash_block` bytes, so it
+        is cheap to compute for large files.
+    """
+    st = os.stat(csvfile)
+    digest = file_hash(csvfile, st.st_size)
+    return np.array([st.st_size, st.st_mtime_ns, digest], dtype=np.int64)
+
+
+def file_hash(fname, size):
+    """ Return hash of the first `size` bytes of `fname`.
+
+        As for `signature`, only the first and last `hash_block` bytes are
+        used.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    with open(fname, 'rb') as fileobj:
+        h.update(fileobj.read(min(size, hash_block)))
+        if size > hash_block:
+            fileobj.seek(max(hash_block, size-hash_block))
+            h.update(fileobj.read(size - fileobj.tell()))
+    return int.from_bytes(h.digest(), 'little', signed=True)
+
+
+def full_hash(fname, size):
+    """ Return hash of the first `size` bytes of `fname`, using every byte.
+
+        This is the same as `file_hash` for files of up to twice
+        `hash_block` bytes.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    with open(fname, 'rb') as fileobj:
+        while size > 0:
+            block = fileobj.read(min(size, hash_block))
+            if not block:
+                break
+            h.update(block)
+            size -= len(block)
+    return int.from_bytes(h.digest(), 'little', signed=True)
+
+
+def write(csvfile, header, kinds, columns):
+    """ Write cache of parsed `columns` for `csvfile`. """
+    arrays = {'signature':signature(csvfile), 'header':np.array(header),
+              'kinds':np.array(kinds)}
+    for n, col in enumerate(columns):
+        # store object arrays as unicode, so they can be read without pickle
+        if col.dtype == object:
+            col = col.astype(str)
+        arrays[f'col{n}'] = col
+
+    fname = cache_path(csvfile)
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as fileobj:
+        np.savez(fileobj, **arrays)
+    os.replace(tmp, fname)
+
+
+def load(csvfile):
+    """ Return list of headers, kinds and columns from the cache.
+
+        If there is no cache or it is out of date, return None.
+    """
+    fname = cache_path(csvfile)
+    if not os.path.exists(fname):
+        return None
+
+    try:
+        with np.load(fname, allow_pickle=False) as npz:
+            if not np.array_equal(npz['signature'], signature(csvfile)):
+                return None
+            header = list(npz['header'])
+            kinds = tuple(npz['kinds'])
+            columns = [npz[f'col{n}'] for n in range(len(header))]
+    except (OSError, KeyError, ValueError):
+        # unreadable cache is treated as stale
+        return None
+
+    header = [str(name) for name in header]
+    kinds = tuple(str(kind) for kind in kinds)
+
+    # cache written with a different schema is out of date
+    if any(schema.get(name.lower(), kind) != kind
+           for name, kind in zip(header, kinds)):
+        return None
+
+    columns = [col.astype(object) if kind == 'str' else col
+               for kind, col in zip(kinds, columns)]
+
+    return header, kinds, columns
+
+
+def drop(csvfile):
+    """ Remove the cache for `csvfile`, if it exists. """
+    fname = cache_path(csvfile)
+    if os.path.exists(fname):
+        os.remove(fname)
+
+
+def rebuild(csvfile):
+    """ Parse `csvfile` and write a new cache. """
+    from dataobject import Data
+    drop(csvfile)
+    Data(csvfile, cache=True)
+
+
+if __name__ == '__main__':
+
+    home = os.path.expanduser('~')
+    default = os.path.join(home, '.mycycle', 'mycycle.csv')
+
+    parser = argparse.ArgumentParser(description='Manage the MyCycle parse '
+                                                 'cache.')
+    parser.add_argument('command', choices=['rebuild', 'drop'])
+    parser.add_argument('csvfile', nargs='?', default=default)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        rebuild(args.csvfile)
+    else:
+        drop(args.csvfile)
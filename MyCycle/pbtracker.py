@@ -0,0 +1,266 @@
+"""
+Personal bests, kept up to date as the data change
+
+The totals and best session of each month and the runs of consecutive days
+are found once, when the tracker is made. After that, adding, removing or
+editing a session only finds the totals of its own month again, from that
+month's sessions, and updates its day; the bests are compared with that
+month, rather than being found again from every session.
+"""
+
+import numpy as np
+from analysedata import (get_best_session, get_best_month, get_best_days,
+                         summarised, hr_to_hrminsec, datefmt, fastest)
+from calendargroup import (group_by, group_keys, key_label, key_range,
+                           date_label)
+from schema import session_columns
+from streaks import find_runs
+from undo import CellChanged, RowAdded, RowRemoved, Reloaded
+
+# columns used to find the personal bests
+pb_columns = session_columns
+
+
+def _month_key(date):
+    return int(np.datetime64(str(date), 'M').astype(np.int64))
+
+
+def _day_key(date):
+    return int(np.datetime64(str(date), 'D').astype(np.int64))
+
+
+def _day_name(key):
+    return np.datetime64(int(key), 'D').item().strftime(datefmt)
+
+
+class PBTracker:
+
+    def __init__(self, data):
+        """ Personal bests of Data object `data`.
+
+            Call `update` with each list of changes sent by `data`.
+            `bestSession`, `bestMonth` and `bestDays` return the same as
+            `get_best_session`, `get_best_month` and `get_best_days`.
+        """
+        self.data = data
+        # sharded data find their personal bests from the shard summaries
+        self._delegate = summarised(data)
+        self.build()
+
+    def build(self):
+        """ Find the personal bests from every session. """
+        # totals of each month: [sessions, time, distance, calories, speed of
+        # best session, date of best session]; the speed and date are None if
+        # no session that month has a time
+        self._months = {}
+        # number of sessions on each day
+        self._days = {}
+        # runs of consecutive days, by first and by last day
+        self._run_last = {}
+        self._run_first = {}
+        # keys of the month with the best session, the best month and the
+        # first day of the longest run
+        self._best_session = None
+        self._best_month = None
+        self._best_run = None
+
+        if self._delegate or len(self.data) == 0:
+            return
+
+        months = group_by(self.data, 'month')
+        for n in range(len(months)):
+            self._months[int(months.keys[n])] = self._monthTotals(
+                months.rows(n))
+        self._best_session = max(self._months, key=self._sessionKey)
+        self._best_month = max(self._months, key=self._monthKey)
+
+        days, counts = np.unique(group_keys(self.data.getColumn('date'),
+                                            'day'),
+                                 return_counts=True)
+        self._days = dict(zip(days.tolist(), counts.tolist()))
+        firsts, lasts = find_runs(days)
+        self._run_last = dict(zip(firsts.tolist(), lasts.tolist()))
+        self._run_first = dict(zip(lasts.tolist(), firsts.tolist()))
+        self._best_run = max(self._run_last, key=self._runKey)
+
+    def _monthTotals(self, rows):
+        """ Return totals of the sessions at array of `rows`, in date order.
+
+            The totals are added up as `group_by` does, so they are exactly
+            the same.
+        """
+        time, dist, cal = (self.data.getColumn(name)[rows].astype(np.float64)
+                           for name in pb_columns[1:])
+        best, speed = fastest(time, dist)
+        if best is None:
+            speed = date = None
+        else:
+            date = str(self.data.getColumn('date')[rows[best]])
+        return [len(rows), float(np.add.reduceat(time, [0])[0]),
+                float(np.add.reduceat(dist, [0])[0]),
+                float(np.add.reduceat(cal, [0])[0]), speed, date]
+
+    def _sessionKey(self, month):
+        """ Best session is the fastest, then the earliest. """
+        speed = self._months[month][4]
+        return (-1 if speed is None else speed), -month
+
+    def _monthKey(self, month):
+        """ Best month has the greatest distance, then is the earliest. """
+        return self._months[month][2], -month
+
+    def _runKey(self, first):
+        """ Longest run has the most days, then is the most recent. """
+        return self._run_last[first] - first, first
+
+    def update(self, changes):
+        """ Update the personal bests after list of `changes` to the data.
+        """
+        if self._delegate:
+            return
+        names = [self.data.columns[change.col].lower()
+                 if isinstance(change, CellChanged) else None
+                 for change in changes]
+        changes = [change for change, name in zip(changes, names)
+                   if name is None or name in pb_columns]
+        if not changes:
+            return
+
+        if (any(isinstance(change, Reloaded) for change in changes)
+                or (any(isinstance(change, CellChanged) for change in changes)
+                    and any(isinstance(change, (RowAdded, RowRemoved))
+                            for change in changes))):
+            # row numbers of the edited cells may have moved
+            self.build()
+            return
+
+        # the totals of every month with an added, removed or edited session
+        # are found again
+        date_idx = self.data.aliases.index('date')
+        months = set()
+        for change in changes:
+            if isinstance(change, RowAdded):
+                date = change.values[date_idx]
+                self._addDay(_day_key(date))
+            elif isinstance(change, RowRemoved):
+                date = change.values[date_idx]
+                self._removeDay(_day_key(date))
+            elif change.col == date_idx:
+                self._removeDay(_day_key(change.old))
+                self._addDay(_day_key(change.new))
+                months.add(_month_key(change.old))
+                date = change.new
+            else:
+                date = self.data[change.row, 'date']
+            months.add(_month_key(date))
+        self._updateMonths(months)
+
+    def _updateMonths(self, months):
+        """ Find the totals of set of `months` again. """
+        dates = self.data.getColumn('date')
+        for key in months:
+            # rows of the month, found by bisection of the date index
+            first, last = key_range('month', key)
+            rows = np.flatnonzero(self.data.dateRange(start=first, end=last))
+            if len(rows) > 0:
+                rows = rows[np.argsort(dates[rows], kind='stable')]
+                self._months[key] = self._monthTotals(rows)
+            else:
+                self._months.pop(key, None)
+
+        if not self._months:
+            self._best_session = self._best_month = None
+            return
+        # if the month with a personal best changed, it may no longer be the
+        # best, so every month has to be compared
+        changed = months & set(self._months)
+        if self._best_session is None or self._best_session in months:
+            self._best_session = max(self._months, key=self._sessionKey)
+        else:
+            self._best_session = max(changed | {self._best_session},
+                                     key=self._sessionKey)
+        if self._best_month is None or self._best_month in months:
+            self._best_month = max(self._months, key=self._monthKey)
+        else:
+            self._best_month = max(changed | {self._best_month},
+                                   key=self._monthKey)
+
+    def _addDay(self, day):
+        """ Add a session on `day`, joining runs of days either side. """
+        count = self._days.get(day, 0)
+        self._days[day] = count + 1
+        if count > 0:
+            return
+
+        first = self._run_first.pop(day-1, day)
+        last = self._run_last.pop(day+1, day)
+        if first != day:
+            del self._run_last[first]
+        if last != day:
+            del self._run_first[last]
+        self._run_last[first] = last
+        self._run_first[last] = first
+
+        if (self._best_run is None or self._best_run not in self._run_last
+                or self._runKey(first) >= self._runKey(self._best_run)):
+            self._best_run = first
+
+    def _removeDay(self, day):
+        """ Remove a session on `day`, splitting its run if it was the last
+            session that day.
+        """
+        count = self._days.pop(day) - 1
+        if count > 0:
+            self._days[day] = count
+            return
+
+        # first day of the run
+        first = day
+        while first-1 in self._days:
+            first -= 1
+        last = self._run_last.pop(first)
+        del self._run_first[last]
+        if first < day:
+            self._run_last[first] = day - 1
+            self._run_first[day-1] = first
+        if day < last:
+            self._run_last[day+1] = last
+            self._run_first[last] = day + 1
+
+        if self._best_run == first:
+            self._best_run = (max(self._run_last, key=self._runKey)
+                              if self._run_last else None)
+
+    def bestSession(self):
+        """ Return speed and date of the fastest session. """
+        if self._delegate:
+            return get_best_session(self.data)
+        if (self._best_session is None
+                or self._months[self._best_session][4] is None):
+            return 0, ''
+        speed, date = self._months[self._best_session][4:]
+        return speed, date_label(date)
+
+    def bestMonth(self):
+        """ Return distance, name, time and calories of the month with the
+            greatest distance.
+        """
+        if self._delegate:
+            return get_best_month(self.data)
+        if self._best_month is None or self._months[self._best_month][2] <= 0:
+            return 0, '', '', 0
+        _, time, dist, cal, _, _ = self._months[self._best_month]
+        return (dist, key_label('month', self._best_month),
+                hr_to_hrminsec(time / 3600), cal)
+
+    def bestDays(self):
+        """ Return length, first and last days of the longest run of
+            consecutive days.
+        """
+        if self._delegate:
+            return get_best_days(self.data)
+        if self._best_run is None:
+            return 0, '', ''
+        last = self._run_last[self._best_run]
+        return (last - self._best_run + 1, _day_name(self._best_run),
+                _day_name(last))
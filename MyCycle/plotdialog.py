@@ -4,23 +4,48 @@ Plot cycling data
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QKeySequence
-from PyQt5.QtWidgets import (QAction, QDesktopWidget, QFileDialog, QGroupBox, 
-                             QHBoxLayout, QPushButton, QRadioButton, 
-                             QVBoxLayout, QWidget)
+from PyQt5.QtWidgets import (QAction, QComboBox, QDesktopWidget, QFileDialog,
+                             QGroupBox, QHBoxLayout, QPushButton,
+                             QRadioButton, QVBoxLayout, QWidget)
 
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import (FigureCanvasQTAgg, 
                                                 NavigationToolbar2QT)
 import numpy as np
-from datetime import datetime
+from analysedata import avg_speed
+from rolling import DailyTotals, windows
+from undo import CellChanged
+
+# columns shown by each line of the plot
+series_columns = {'speed': {'date', 'time', 'distance (km)'},
+                  'average': {'date', 'time', 'distance (km)'},
+                  'odometer': {'date', 'odometer (km)'}}
 
 
 class PlotDialog(QWidget):
-    def __init__(self, data, scheme='dark'):
+    def __init__(self, data, scheme='dark', totals=None):
+        """ Plot of Data object `data`.
+
+            `totals` are the DailyTotals of `data` used for the rolling
+            average, if they are kept up to date elsewhere. By default, they
+            are found from the data when the plot is drawn.
+        """
         super().__init__()
         
         self.data = data
+        self.totals = totals
         self.scheme = scheme
+        # True if the data have changed while the plot was hidden
+        self.stale = False
+        # length (in days) of the rolling average speed drawn over the
+        # sessions, or None
+        self.window = None
+        # 'mountain' or 'staircase'
+        self.background_fill = 'mountain'
+        # lines and fill of each series (see `series_columns`), and the first
+        # and last months plotted, once the plot has been drawn
+        self.artists = None
+        self.months = None
 
         # a figure instance to plot on
         self.figure = Figure()
@@ -57,9 +82,16 @@ class PlotDialog(QWidget):
         self.exportBtn.setShortcut(QKeySequence(Qt.CTRL + Qt.Key_E))
         self.exportBtn.clicked.connect(self.export)
         
+        self.windowBox = QComboBox()
+        self.windowBox.addItem('No rolling average', None)
+        for window in windows:
+            self.windowBox.addItem(f'{window} day average', window)
+        self.windowBox.currentIndexChanged.connect(self.set_window)
+
         allBox = QHBoxLayout()
         allBox.addLayout(schemeBtnBox)
         allBox.addWidget(self.exportBtn, alignment=Qt.AlignVCenter)
+        allBox.addWidget(self.windowBox, alignment=Qt.AlignVCenter)
         allBox.setAlignment(schemeBtnBox, Qt.AlignVCenter)
         allBox.addStretch(1)
         
@@ -84,6 +116,105 @@ class PlotDialog(QWidget):
                                triggered=self.close)
         self.addAction(self.exitAct)
         
+        self.data.subscribe(self.dataChanged)
+
+    def dataChanged(self, changes):
+        """ Update the lines of the plot which show data in the `changes`.
+
+            The whole plot is only drawn again if the first or last month
+            with a session has changed, as the date axis then changes too.
+            If the plot is hidden, it is redrawn when next shown.
+        """
+        series = set()
+        for change in changes:
+            if isinstance(change, CellChanged):
+                name = self.data.columns[change.col].lower()
+                series |= {key for key, columns in series_columns.items()
+                           if name in columns}
+            else:
+                series |= set(series_columns)
+        if not series:
+            return
+        if not self.isVisible():
+            self.stale = True
+        elif self.artists is None or self._months() != self.months:
+            self.plot()
+        else:
+            self.updatePlot(series)
+
+    def _months(self):
+        """ Return first and last months with a session. """
+        dates = self.data.getColumn('Date')
+        if len(dates) == 0:
+            return None
+        return (np.min(dates).astype('datetime64[M]'),
+                np.max(dates).astype('datetime64[M]'))
+
+    def _speed(self):
+        """ Return dates and average speed of each session. """
+        return (self.data.getColumn('Date'),
+                avg_speed(self.data.getColumn('Time'),
+                          self.data.getColumn('Distance (km)')))
+
+    def _average(self):
+        """ Return days and rolling average speed over `window` days. """
+        totals = self.totals
+        if totals is None:
+            totals = DailyTotals.fromData(self.data)
+        return totals.days, totals.speed(self.window)
+
+    def _odometer(self):
+        """ Return dates and odometer readings to plot, as a mountain or a
+            staircase.
+        """
+        dates = self.data.getColumn('Date')
+        odo = self.data.getColumn('Odometer (km)')
+        if self.background_fill == 'staircase':
+            # TODO staircase doesn't quite work yet: the last one doesn't
+            # appear
+            dates = np.concatenate((dates[:1], np.repeat(dates[1:], 2)))
+            odo = np.repeat(odo[:-1], 2)
+        return dates, odo
+
+    def updatePlot(self, series):
+        """ Update the lines of set of `series` (see `series_columns`) from
+            the data and rescale the axes, without drawing the rest of the
+            plot again.
+        """
+        if 'speed' in series:
+            self.artists['speed'].set_data(*self._speed())
+        if 'average' in series and 'average' in self.artists:
+            self.artists['average'].set_data(*self._average())
+        if 'odometer' in series:
+            line, fill = self.artists['odometer']
+            dates, odo = self._odometer()
+            line.set_data(dates, odo)
+            # a filled area can't be given new data, so it is replaced
+            colour = fill.get_facecolor()
+            fill.remove()
+            fill = line.axes.fill_between(dates, 0, odo, facecolor=colour)
+            self.artists['odometer'] = (line, fill)
+
+        ax1 = self.artists['speed'].axes
+        line, fill = self.artists['odometer']
+        ax2 = line.axes
+        for ax in [ax1, ax2]:
+            ax.relim()
+        # relim only finds the limits of the lines, not the filled area
+        ax2.update_datalim(fill.get_datalim(ax2.transData))
+        for ax in [ax1, ax2]:
+            ax.autoscale_view()
+        self.canvas.draw_idle()
+
+    def showEvent(self, event):
+        if self.stale:
+            self.plot()
+        super().showEvent(event)
+
+    def closeEvent(self, event):
+        self.data.unsubscribe(self.dataChanged)
+        super().closeEvent(event)
+
     def centre(self):
         """ Centre window on screen. """
         qr = self.frameGeometry()
@@ -99,6 +230,10 @@ class PlotDialog(QWidget):
         self.scheme = 'light'
         self.plot()
         
+    def set_window(self, idx):
+        self.window = self.windowBox.itemData(idx)
+        self.plot()
+
     def export(self):
         facecolor = self.colour_schemes[self.scheme]['bg_col']
         
@@ -108,36 +243,14 @@ class PlotDialog(QWidget):
         if filename:
             self.figure.savefig(filename, format='pdf', facecolor=facecolor)
             self.figure.clf()
+            self.artists = None
 
     def plot(self):
         
+        self.stale = False
         self.figure.clf()
-        
-        dflen = len(self.data)
-        
-        time_sec = np.array(list(self._minsec_to_sec(time) 
-                            for time in self.data.getColumn('Time')))
-        
-        dist_norm = np.array(list(self._normalise(time_sec[n], 
-                                                  self.data[n,'Distance (km)'],
-                                                  wrt='hr') 
-                             for n in range(dflen)))
-            
-        cal_norm = np.array(list(self._normalise(time_sec[n], 
-                                                 self.data[n,'Calories']) 
-                            for n in range(dflen)))
-            
-        dates = list(datetime.strptime(date, '%Y-%m-%d').date() 
-                     for date in self.data.getColumn('Date'))
-        
-        # TODO staircase doesn't quite work yet: the last one doesn't appear
-        dates_long = [dates[0]] + [i for i in dates[1:] for n in range(2)]
-        
-        odo = self.data.getColumn('Odometer (km)')
-        odo_long = [i for i in odo[:-1] for n in range(2)]
-        
-        fill_style = ['mountain', 'staircase']
-        background_fill = fill_style[0]
+        self.artists = {}
+        self.months = self._months()
         
         # make axes
         ax1 = self.figure.add_subplot(111)
@@ -146,10 +259,10 @@ class PlotDialog(QWidget):
         # define colour schemes
         light_colours = {'ax1_col':'green', 'ax2_col1':'lightskyblue',
                          'ax2_col2':'dodgerblue', 'bg_col':'white', 
-                         'fg_col':'black'}
+                         'fg_col':'black', 'avg_col':'darkorange'}
         dark_colours  = {'ax1_col':'lime', 'ax2_col1':'dodgerblue',
                          'ax2_col2':'dodgerblue', 'bg_col':'#393f45', 
-                         'fg_col':'white'}
+                         'fg_col':'white', 'avg_col':'orange'}
         
         self.colour_schemes = {'light':light_colours, 'dark':dark_colours}
 
@@ -158,6 +271,7 @@ class PlotDialog(QWidget):
         ax2_col2 = self.colour_schemes[self.scheme]['ax2_col2']
         bg_col = self.colour_schemes[self.scheme]['bg_col']
         fg_col = self.colour_schemes[self.scheme]['fg_col']
+        avg_col = self.colour_schemes[self.scheme]['avg_col']
         
         ax1.tick_params(axis='x', colors=fg_col)
         ax1.spines['bottom'].set_color(fg_col)
@@ -168,19 +282,24 @@ class PlotDialog(QWidget):
         self.figure.patch.set_facecolor(bg_col)
         ax1.set_facecolor(bg_col)
         
-        # ax1 y data
-        ax1.plot_date(dates, dist_norm, color=ax1_col, marker='x')
+        # ax1 y data; sessions with no time have no speed, so aren't shown
+        self.artists['speed'], = ax1.plot_date(*self._speed(), color=ax1_col,
+                                               marker='x')
         ax1.set_ylabel('Avg. speed (km/h)', color=ax1_col)
+
+        # rolling average speed; gaps where there were no sessions in the
+        # window
+        if self.window is not None:
+            self.artists['average'], = ax1.plot_date(
+                *self._average(), color=avg_col, marker='', linestyle='-')
         ax1.tick_params('y', color=ax1_col, labelcolor=ax1_col)
         
         # ax2 y data
-        if background_fill == 'mountain':
-            ax2.plot_date(dates, odo, color=ax2_col1, marker='', xdate=True) 
-            ax2.fill_between(dates, odo, facecolor=ax2_col1)
-        
-        elif background_fill == 'staircase':
-            ax2.plot_date(dates_long, odo_long, color=ax2_col1, marker='') 
-            ax2.fill_between(dates_long, 0, odo_long, facecolor=ax2_col1)
+        dates, odo = self._odometer()
+        line, = ax2.plot_date(dates, odo, color=ax2_col1, marker='',
+                              xdate=True)
+        fill = ax2.fill_between(dates, 0, odo, facecolor=ax2_col1)
+        self.artists['odometer'] = (line, fill)
             
 #        ax2.set_ylim(bottom=75)
         ax2.set_ylabel('Total distance (km)', color=ax2_col2)
@@ -200,32 +319,3 @@ class PlotDialog(QWidget):
     
         # refresh canvas
         self.canvas.draw()
-            
-    @staticmethod
-    def _minsec_to_sec(s):
-        
-        s_spl = s.split(':')
-        s_spl = list(map(int, s_spl))
-        
-        try:
-            mns, sec = s_spl
-        except ValueError:
-            mns = s_spl[0]
-            sec = 0
-            
-        total = 60 * mns + sec
-        
-        return total
-    
-    @staticmethod
-    def _normalise(time, value, wrt='min'):
-        # Normalise a value 
-        # `time` should be in seconds
-        # `wrt` should be 'sec', 'min' or 'hr'
-        
-        factor = {'sec':1, 'min':60, 'hr':3600}
-        
-        mult = factor[wrt]
-        
-        return mult * value / time
-
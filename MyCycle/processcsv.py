@@ -2,10 +2,13 @@
 Provides functions to read csv data and supply it in html format for MyCycle
 """
 
-import calendar
 import re
 import itertools
 import sys
+import hashlib
+import numpy as np
+from calendargroup import group_by, month_label, date_label
+from schema import format_column, table_columns
 
 
 def head_tail(text):
@@ -135,25 +138,108 @@ def csv_to_html(text):
     return html
 
 
+def data_to_html(data, cache=None):
+    """ Write html string from Data object `data`.
+
+        This gives the same html as `csv_to_html(str(data))`, but works on
+        the columns of `data`, rather than writing and parsing csv text.
+        The only difference is that sessions on the same day are shown in
+        reverse order of their rows, rather than of their csv text.
+
+        If `cache` is given, it should be a dict, in which the html for each
+        month is kept between calls, with a hash of that month's rows. Only
+        the months whose rows have changed are rendered again.
+    """
+
+    html = [get_preamble()]
+
+    if len(data) == 0:
+        html.append(get_empty())
+
+    else:
+        html += _month_fragments(data, {} if cache is None else cache)
+
+    html.append(get_close())
+
+    return ''.join(html)
+
+
+def _month_fragments(data, cache):
+    """ Return list of html for each month, from the most recent.
+
+        `cache` is a dict of (hash, html) tuples, keyed by (year, month). It
+        is updated with any months that are rendered, and months which are no
+        longer in `data` are removed.
+    """
+    # most recent first; same day sessions in reverse order, as in the csv
+    months = group_by(data, 'month', reverse=True)
+    columns = [data.getColumn(name)[months.order] for name in table_columns]
+    kinds = [data.kinds[data.aliases.index(name)] for name in table_columns]
+
+    fragments = []
+    keys = set()
+    for n, (start, end) in enumerate(zip(months.starts, months.ends)):
+        key = divmod(int(months.keys[n]), 12)
+        digest = _rows_hash([col[start:end] for col in columns])
+        cached = cache.get(key)
+        if cached is None or cached[0] != digest:
+            totals = [months.totals[name][n]
+                      for name in ['time', 'calories', 'distance (km)']]
+            html = _render_month([col[start:end] for col in columns], kinds,
+                                 months.label(n), totals)
+            cached = cache[key] = (digest, html)
+        fragments.append(cached[1])
+        keys.add(key)
+
+    for key in set(cache) - keys:
+        del cache[key]
+
+    return fragments
+
+
+def _rows_hash(columns):
+    """ Return hash of the values in list of arrays `columns`. """
+    h = hashlib.blake2b(digest_size=16)
+    for col in columns:
+        if col.dtype == object:
+            h.update('\0'.join(map(str, col)).encode())
+        else:
+            h.update(np.ascontiguousarray(col).tobytes())
+    return h.digest()
+
+
+def _render_month(columns, kinds, monthyear, totals):
+    """ Return header and table html for the rows of one month.
+
+        `columns` are arrays of the `table_columns` and `kinds` their kinds.
+        `monthyear` is the name of the month and `totals` are its total time,
+        calories and distance.
+    """
+    dates, time_sec, dist, cal, odo, gear, weight = columns
+
+    # each column as list of strings
+    date_str = [date_label(day, short=True) for day in dates.astype(str)]
+    strings = [date_str, format_column('duration', time_sec)]
+    strings += [[str(v) for v in col.tolist()] for col in [dist, cal, odo]]
+    strings += [format_column(kinds[5], gear), format_column(kinds[6], weight)]
+    rows = list(zip(*strings))
+
+    total_time, total_cal, total_dist = totals
+    total_time = get_hr_min_sec(int(total_time))
+
+    return (get_header(len(rows), monthyear, total_time, total_cal, total_dist)
+            + get_table(rows))
+
+
 def _parse_line(line):
     """ Take line from csv and extract/reformat where necessary."""
     
     date, time, dist, cal, odo, gear, weight = re.split(',', line.strip())
     
     # date is in YYYY-MM-DD order, want DD Month YY, where Month is abbreviation
-    date_list = re.split('-', date)
-    date_list.reverse()
-    
-    # get month abbreviation and full name
-    month_num = int(date_list[1])
-    month_short = calendar.month_abbr[month_num]
-    month_full = calendar.month_name[month_num]
-    year = date_list[2]
-    month = month_full + ' ' + year
-    
-    date_list[1] = month_short
-    date_list[2] = date_list[2][-2:]  # remove century from year
-    date = ' '.join(date_list)
+    year, month_num, _ = date.split('-')
+    month = month_label(year, month_num)
+    date = date_label(date, short=True)
     
     # if time is scalar, this is exact number of minutes
     if len(time.split(':')) == 1:
@@ -264,9 +350,7 @@ def get_table(data):
         <th width=14.25%>Weight (kg)</th>
     </tr>'''
     
-    table_body = ''
-    for row in data:
-        table_body += '''
+    table_body = ''.join('''
         <tr>
             <td>{}</td>
             <td>{}</td>
@@ -275,7 +359,7 @@ def get_table(data):
             <td>{}</td>
             <td>{}</td>
             <td>{}</td>
-        </tr>'''.format(*row)
+        </tr>'''.format(*row) for row in data)
     
     table_end = '''</table>'''
     
@@ -0,0 +1,148 @@
+"""
+Conditions for querying a Data object with `Data.where`.
+
+Conditions are made by comparing a Column with a value, and can be combined
+with & (and), | (or) and ~ (not). For example
+
+>>> from query import Column
+>>> cond = (Column('Gear').isin({5, 6}) & (Column('Distance (km)') > 20)
+...         | Column('Date').between('2020-01-01', '2020-01-31'))
+>>> data.where(cond, mode='row')
+
+Each condition is evaluated as a vectorized operation on the whole column.
+Date ranges are found by bisection of the sorted date index.
+"""
+
+import operator
+import numpy as np
+
+
+class Condition:
+    """ Base class for conditions, which return a boolean mask for Data. """
+
+    def evaluate(self, data):
+        """ Return boolean array which is True for rows meeting the condition.
+        """
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return Combined(operator.and_, self, other)
+
+    def __or__(self, other):
+        return Combined(operator.or_, self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Combined(Condition):
+
+    def __init__(self, op, *conditions):
+        """ Combine conditions with bitwise operator `op`. """
+        self.op = op
+        self.conditions = conditions
+
+    def evaluate(self, data):
+        masks = [cond.evaluate(data) for cond in self.conditions]
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = self.op(mask, other)
+        return mask
+
+
+class Not(Condition):
+
+    def __init__(self, condition):
+        self.condition = condition
+
+    def evaluate(self, data):
+        return ~self.condition.evaluate(data)
+
+
+class Compare(Condition):
+
+    def __init__(self, column, op, value):
+        """ Compare `column` with `value` using operator `op`. """
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def evaluate(self, data):
+        idx = data._getColumnIndex(self.column)
+        value = data._toStorage(idx, self.value)
+
+        # use date index for inequalities on dates
+        if data.kinds[idx] == 'date':
+            if self.op in [operator.gt, operator.ge]:
+                inclusive = self.op is operator.ge
+                return data.dateRange(idx, start=value, inclusive=inclusive)
+            elif self.op in [operator.lt, operator.le]:
+                inclusive = self.op is operator.le
+                return data.dateRange(idx, end=value, inclusive=inclusive)
+
+        return self.op(data.getColumn(idx), value)
+
+
+class Between(Condition):
+
+    def __init__(self, column, low, high):
+        """ Values in `column` between `low` and `high`, inclusive. """
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def evaluate(self, data):
+        idx = data._getColumnIndex(self.column)
+        low = data._toStorage(idx, self.low)
+        high = data._toStorage(idx, self.high)
+
+        if data.kinds[idx] == 'date':
+            return data.dateRange(idx, start=low, end=high)
+
+        col = data.getColumn(idx)
+        return (col >= low) & (col <= high)
+
+
+class IsIn(Condition):
+
+    def __init__(self, column, values):
+        """ Values in `column` which are members of `values`. """
+        self.column = column
+        self.values = values
+
+    def evaluate(self, data):
+        idx = data._getColumnIndex(self.column)
+        values = [data._toStorage(idx, value) for value in self.values]
+        col = data.getColumn(idx)
+        return np.isin(col, np.array(values, dtype=col.dtype))
+
+
+class Column:
+
+    def __init__(self, name):
+        """ Column of Data, by name, alias or index, to make conditions. """
+        self.name = name
+
+    def __eq__(self, value):
+        return Compare(self.name, operator.eq, value)
+
+    def __ne__(self, value):
+        return Compare(self.name, operator.ne, value)
+
+    def __lt__(self, value):
+        return Compare(self.name, operator.lt, value)
+
+    def __le__(self, value):
+        return Compare(self.name, operator.le, value)
+
+    def __gt__(self, value):
+        return Compare(self.name, operator.gt, value)
+
+    def __ge__(self, value):
+        return Compare(self.name, operator.ge, value)
+
+    def between(self, low, high):
+        return Between(self.name, low, high)
+
+    def isin(self, values):
+        return IsIn(self.name, values)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Report of the personal bests and monthly totals, without the GUI
+
+This only needs numpy, so it can be run where PyQt5 and Matplotlib aren't
+installed, e.g. from cron
+
+    python report.py --format text|html|json [--since DATE] [-o FILE] [path]
+
+or through the `mycycle` script, as `mycycle report ...`. `path` is the
+MyCycle directory (default ~/.mycycle), a csv file or an SQLite database.
+"""
+
+import argparse
+import json
+import os.path
+import sys
+import numpy as np
+from dataobject import Data
+from sqlitedata import SQLiteData
+from shardeddata import ShardedData, summary_name
+from analysedata import (get_best_session, get_best_month, get_best_days,
+                         get_current_streak, get_year_streaks)
+from calendargroup import group_by, month_label
+from processcsv import get_hr_min_sec, get_preamble, get_close, get_empty
+
+home = os.path.expanduser('~')
+
+formats = ['text', 'html', 'json']
+
+
+def open_data(path=os.path.join(home, '.mycycle'), readonly=False):
+    """ Return Data object for the MyCycle directory `path`.
+
+        The SQLite database is used if the csv has been migrated to one and
+        the yearly shards if the csv has been split. Otherwise, the data are
+        read from mycycle.csv. If `readonly` is True, no file is written
+        (see `Data`).
+    """
+    dbfile = os.path.join(path, 'mycycle.db')
+    if os.path.exists(dbfile):
+        return SQLiteData(dbfile, readonly=readonly)
+    elif os.path.exists(os.path.join(path, summary_name)):
+        return ShardedData(path, readonly=readonly)
+    else:
+        return Data(os.path.join(path, 'mycycle.csv'), journal=True,
+                    cache=True, readonly=readonly)
+
+
+def make_report(data, since=None):
+    """ Return dict of the personal bests and monthly totals of `data`.
+
+        Parameters
+        ----------
+        data : Data object
+        since : str, optional
+            if given, only sessions on or after this date (YYYY-MM-DD) are
+            included.
+    """
+    if isinstance(data, ShardedData):
+        # every year in the report needs to be read
+        for year in data.years:
+            if since is None or year >= int(str(since)[:4]):
+                data.loadYear(year)
+    # the database totals the months itself
+    totals = _sql_totals(data, since) if isinstance(data, SQLiteData) else None
+    if since is not None:
+        data = data.subset(data.dateRange(start=since))
+    if totals is None:
+        totals = _month_totals(data)
+    num, time, dist, cal, months = totals
+
+    dates = data.getColumn('date')
+    speed, speed_date = get_best_session(data)
+    month_dist, month, month_time, month_cal = get_best_month(data)
+    streak, streak_first, streak_last = get_best_days(data)
+    current = get_current_streak(data)
+    years = get_year_streaks(data)
+
+    report = {
+        'since': None if since is None else str(since),
+        'sessions': int(num),
+        'first': str(np.min(dates)) if len(data) else None,
+        'last': str(np.max(dates)) if len(data) else None,
+        'time': int(time),
+        'distance': round(float(dist), 2),
+        'calories': round(float(cal), 2),
+        # null if no session has a time, so none has an average speed
+        'best_session': ({'speed': round(speed, 2), 'date': speed_date}
+                         if speed_date else {'speed': None, 'date': None}),
+        'best_month': {'month': month, 'distance': round(month_dist, 2),
+                       'time': month_time, 'calories': round(month_cal, 2)},
+        'longest_streak': {'days': streak, 'first': streak_first,
+                           'last': streak_last},
+        'current_streak': dict(zip(['days', 'first', 'last'], current)),
+        'year_streaks': {str(year): dict(zip(['days', 'first', 'last'],
+                                             years[year]))
+                         for year in sorted(years)},
+        'months': [{'month': month, 'sessions': int(num),
+                    'time': int(time), 'distance': round(float(dist), 2),
+                    'calories': round(float(cal), 2)}
+                   for month, num, time, dist, cal in months]
+    }
+    return report
+
+
+def _month_totals(data):
+    """ Return number of sessions, total time, distance and calories of
+        `data`, and list of (label, sessions, time, distance, calories) of
+        each month.
+    """
+    months = group_by(data, 'month')
+    time, dist, cal = (months.totals[name]
+                       for name in ['time', 'distance (km)', 'calories'])
+    rows = [(months.label(n), months.counts[n], time[n], dist[n], cal[n])
+            for n in range(len(months))]
+    return len(data), np.sum(time), np.sum(dist), np.sum(cal), rows
+
+
+def _sql_totals(data, since=None):
+    """ As `_month_totals`, for SQLiteData `data` on or after `since`, with
+        the totals found by SQLite.
+    """
+    num, time, dist, cal = data.totals(start=since)
+    rows = []
+    for month, *values in data.monthly_totals(start=since):
+        rows.append((month_label(*month.split('-')), *values))
+    return num, time, dist, cal, rows
+
+
+def _bests(report):
+    """ Return list of (name, text) of the personal bests in `report`. """
+    session = report['best_session']
+    month = report['best_month']
+    streak = report['longest_streak']
+    current = report['current_streak']
+    years = [(f'Streak in {year}', f"{streak['days']} days, from "
+                                   f"{streak['first']} to {streak['last']}")
+             for year, streak in report['year_streaks'].items()]
+    if session['speed'] is None:
+        best = 'no sessions with a time'
+    else:
+        best = f"{session['speed']:.2f} km/h on {session['date']}"
+    return [('Best session', best),
+            ('Best month', f"{month['distance']:.2f} km in {month['month']} "
+                           f"({month['time']}, {month['calories']:.2f} cal)"),
+            ('Longest streak', f"{streak['days']} days, from "
+                               f"{streak['first']} to {streak['last']}"),
+            ('Current streak', f"{current['days']} days"
+                               + (f", from {current['first']}"
+                                  if current['days'] else ''))] + years
+
+
+def format_text(report):
+    """ Return `report` as plain text. """
+    lines = []
+    if report['since'] is not None:
+        lines.append(f"Since {report['since']}")
+    lines.append(f"{report['sessions']} sessions, "
+                 f"{get_hr_min_sec(report['time'])}, "
+                 f"{report['distance']:.2f} km, {report['calories']:.2f} cal")
+    if report['sessions'] == 0:
+        return '\n'.join(lines) + '\n'
+
+    lines.append('')
+    lines += [f'{name + ":":<16}{text}' for name, text in _bests(report)]
+
+    lines.append('')
+    lines.append(f"{'Month':<16}{'Sessions':>9}{'Time':>12}"
+                 f"{'Distance (km)':>15}{'Calories':>12}")
+    for month in report['months']:
+        lines.append(f"{month['month']:<16}{month['sessions']:>9}"
+                     f"{get_hr_min_sec(month['time']):>12}"
+                     f"{month['distance']:>15.2f}{month['calories']:>12.2f}")
+    return '\n'.join(lines) + '\n'
+
+
+def format_html(report):
+    """ Return `report` as html, styled like the main window. """
+    html = [get_preamble()]
+    if report['since'] is not None:
+        html.append(f"<h1>Since {report['since']}</h1>")
+    html.append(f"<h2>{report['sessions']} sessions, "
+                f"{get_hr_min_sec(report['time'])}, "
+                f"{report['distance']:.2f} km, "
+                f"{report['calories']:.2f} cal</h2>")
+
+    if report['sessions'] == 0:
+        html.append(get_empty())
+    else:
+        html.append('\n<h1>Personal bests</h1>\n<table>')
+        html += [f'\n    <tr><th>{name}</th><td>{text}</td></tr>'
+                 for name, text in _bests(report)]
+        html.append('\n</table>')
+
+        html.append('\n<h1>Monthly totals</h1>\n<table>\n    <tr>')
+        html += [f'\n        <th>{name}</th>' for name in
+                 ['Month', 'Sessions', 'Time', 'Distance (km)', 'Calories']]
+        html.append('\n    </tr>')
+        for month in report['months']:
+            values = [month['month'], month['sessions'],
+                      get_hr_min_sec(month['time']),
+                      f"{month['distance']:.2f}", f"{month['calories']:.2f}"]
+            html.append('\n    <tr>')
+            html += [f'\n        <td>{value}</td>' for value in values]
+            html.append('\n    </tr>')
+        html.append('\n</table>')
+
+    html.append(get_close())
+    return ''.join(html)
+
+
+def format_json(report):
+    """ Return `report` as json.
+
+        The report never has NaN or infinite values, so it is strict json.
+    """
+    return json.dumps(report, indent=2, allow_nan=False) + '\n'
+
+
+def open_path(path):
+    """ Return read-only Data object for `path`, which can be a MyCycle
+        directory, a csv file or an SQLite database.
+
+        Sessions in the csv's journal are included, but the journal and the
+        parse cache are left as they are.
+    """
+    if os.path.isdir(path):
+        return open_data(path, readonly=True)
+    elif path.endswith('.db'):
+        return SQLiteData(path, readonly=True)
+    else:
+        return Data(path, journal=True, cache=True, readonly=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Report MyCycle personal '
+                                                 'bests and monthly totals.')
+    parser.add_argument('path', nargs='?',
+                        default=os.path.join(home, '.mycycle'),
+                        help='MyCycle directory, csv file or SQLite database')
+    parser.add_argument('--format', choices=formats, default='text')
+    parser.add_argument('--since', metavar='DATE',
+                        help='only include sessions on or after DATE '
+                             '(YYYY-MM-DD)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the report to FILE, rather than stdout')
+    args = parser.parse_args()
+
+    if args.since is not None:
+        try:
+            np.datetime64(args.since, 'D')
+        except ValueError:
+            parser.error(f"invalid date '{args.since}'")
+
+    data = open_path(args.path)
+    if data.journal_conflict:
+        print(f"Warning: '{data.journalfile}' doesn't match "
+              f"'{data.csvfile}', so its sessions aren't included",
+              file=sys.stderr)
+    report = make_report(data, since=args.since)
+    text = {'text': format_text,
+            'html': format_html,
+            'json': format_json}[args.format](report)
+
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as fileobj:
+            fileobj.write(text)
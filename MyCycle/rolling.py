@@ -0,0 +1,190 @@
+"""
+Totals and average speed over rolling windows of days
+
+The sessions are added up into one bin per day, from the first session to the
+last (or a later end date), and the cumulative sum of each column is found
+once. The total over a window of any length, ending on every day, is then a
+difference of two cumulative sums. When a session is added, removed or edited,
+only the cumulative sums from its day on are changed.
+"""
+
+import numpy as np
+from analysedata import avg_speed
+from schema import minsec_to_sec, session_columns
+from undo import CellChanged, RowAdded, Reloaded
+
+# window lengths, in days, shown by default
+windows = [7, 30, 365]
+
+# columns which are binned
+columns = session_columns[1:]
+
+# the distance of the sessions with a time, which is also binned, for the
+# average speed
+timed = 'timed distance'
+
+
+class DailyTotals:
+
+    def __init__(self, dates, time, dist, cal, end=None):
+        """ Daily totals of sessions on array of datetime64 `dates`, with
+            durations `time` (in seconds), distances `dist` and calories
+            `cal`.
+
+            The days run from the first date to the last date or `end`,
+            whichever is later. Days without a session have totals of 0.
+        """
+        self._bin(dates, time, dist, cal, end)
+
+    def _bin(self, dates, time, dist, cal, end=None):
+        """ Add up the sessions for each day and find the cumulative sums.
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if len(dates) == 0:
+            self.start = None
+            self.days = np.zeros(0, dtype='datetime64[D]')
+            self._cumsums = {name: np.zeros(1) for name in columns + [timed]}
+            return
+
+        self.start = np.min(dates)
+        last = np.max(dates)
+        if end is not None:
+            last = max(last, np.datetime64(str(end), 'D'))
+        num = (last - self.start).astype(np.int64) + 1
+        self.days = self.start + np.arange(num)
+
+        idx = (dates - self.start).astype(np.int64)
+        self._cumsums = {}
+        dist = np.asarray(dist, dtype=np.float64)
+        timed_dist = np.where(np.asarray(time) > 0, dist, 0)
+        for name, values in zip(columns + [timed], [time, dist, cal,
+                                                    timed_dist]):
+            weights = np.asarray(values, dtype=np.float64)
+            daily = np.bincount(idx, weights=weights, minlength=num)
+            self._cumsums[name] = np.concatenate(([0], np.cumsum(daily)))
+
+    @classmethod
+    def fromData(cls, data, end=None):
+        """ Return DailyTotals of the sessions in Data object `data`. """
+        return cls(*(data.getColumn(name) for name in ['date'] + columns),
+                   end=end)
+
+    def __len__(self):
+        return len(self.days)
+
+    def extend(self, end):
+        """ Add days with totals of 0, so the days run to at least `end`. """
+        end = np.datetime64(str(end), 'D')
+        if self.start is None:
+            self.start = end
+            self.days = np.array([end])
+            self._cumsums = {name: np.zeros(2) for name in columns + [timed]}
+            return
+        num = (end - self.start).astype(np.int64) + 1
+        if num > len(self):
+            self.days = self.start + np.arange(num)
+            self._cumsums = {name: np.concatenate(
+                                 (csum, np.full(num + 1 - len(csum), csum[-1])))
+                             for name, csum in self._cumsums.items()}
+
+    def add(self, date, time, dist, cal):
+        """ Add a session on `date` with duration `time` (in seconds),
+            distance `dist` and calories `cal` to the totals.
+
+            A session is taken away by adding negative values.
+        """
+        date = np.datetime64(str(date), 'D')
+        self.extend(date)
+        if date < self.start:
+            # days with totals of 0 before the first
+            num = (self.start - date).astype(np.int64)
+            self.start = date
+            self.days = date + np.arange(len(self) + num)
+            self._cumsums = {name: np.concatenate((np.zeros(num), csum))
+                             for name, csum in self._cumsums.items()}
+        idx = (date - self.start).astype(np.int64)
+        timed_dist = dist if time != 0 else 0
+        for name, value in zip(columns + [timed], [time, dist, cal,
+                                                   timed_dist]):
+            self._cumsums[name][idx+1:] += value
+
+    def update(self, changes, data):
+        """ Update the totals after list of `changes` to Data object `data`.
+        """
+        if (any(isinstance(change, Reloaded) for change in changes)
+                or (len(changes) > 1
+                    and any(isinstance(change, CellChanged)
+                            for change in changes))):
+            # edits are rare, and their row numbers may have moved, so the
+            # totals are found again
+            end = self.days[-1] if len(self) else None
+            self._bin(*(data.getColumn(name) for name in ['date'] + columns),
+                      end=end)
+            return
+
+        names = ['date'] + columns
+        for change in changes:
+            if isinstance(change, CellChanged):
+                name = data.columns[change.col].lower()
+                if name not in names:
+                    continue
+                values = data.getRow(change.row)
+                values[change.col] = change.old
+                self._addValues(data, values, -1)
+                values[change.col] = change.new
+                self._addValues(data, values)
+            else:
+                sign = 1 if isinstance(change, RowAdded) else -1
+                self._addValues(data, change.values, sign)
+
+    def _addValues(self, data, values, sign=1):
+        """ Add session with list of `values` of a row of `data`, times
+            `sign`.
+        """
+        date, time, dist, cal = (values[data.aliases.index(name)]
+                                 for name in ['date'] + columns)
+        self.add(date, sign * minsec_to_sec(time), sign * float(dist),
+                 sign * float(cal))
+
+    def total(self, column, window):
+        """ Return array of the total of `column` over the `window` days
+            ending on each day.
+        """
+        csum = self._cumsums[column]
+        idx = np.arange(1, len(csum))
+        return csum[idx] - csum[np.maximum(idx - window, 0)]
+
+    def speed(self, window):
+        """ Return array of the average speed (in km/h) over the `window` days
+            ending on each day, or NaN where there were no sessions with a
+            time.
+
+            As for a single session (see `analysedata.avg_speed`), sessions
+            with no time are left out.
+        """
+        return avg_speed(self.total('time', window),
+                         self.total(timed, window))
+
+    def latest(self, window):
+        """ Return total time, distance and calories and the average speed of
+            the last `window` days. The speed is 0 if there were no sessions
+            with a time.
+        """
+        if len(self) == 0:
+            return 0, 0., 0., 0.
+        time, dist, cal = (float(self.total(name, window)[-1])
+                           for name in columns)
+        speed = float(self.speed(window)[-1])
+        if np.isnan(speed):
+            speed = 0.
+        return int(time), dist, cal, speed
+
+    def best(self, column, window):
+        """ Return the greatest total of `column` over `window` days, and the
+            last day of that window (the earliest, if there is a tie).
+        """
+        if len(self) == 0:
+            return 0., None
+        totals = self.total(column, window)
+        idx = int(np.argmax(totals))
+        return float(totals[idx]), self.days[idx]
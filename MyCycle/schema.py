@@ -0,0 +1,162 @@
+"""
+Schema for MyCycle data: the kind of data in each column and how to parse it.
+
+The standard columns have declared kinds. Any other column has its kind
+inferred from all of its values.
+Whole columns are parsed in bulk; if a value cannot be parsed, the error
+reports its row and column.
+"""
+
+import numpy as np
+
+# columns in a new csv file
+default_columns = ['Date', 'Time', 'Distance (km)', 'Calories', 'Odometer (km)',
+                   'Gear', 'Weight (kg)']
+
+# columns of a session which are totalled and used for the personal bests
+session_columns = ['date', 'time', 'distance (km)', 'calories']
+
+# columns shown in the table and html views, in order
+table_columns = ['date', 'time', 'distance (km)', 'calories', 'odometer (km)',
+                 'gear', 'weight (kg)']
+
+# kind of data in each of the standard columns, by lower case name
+schema = {'date':'date', 'time':'duration', 'distance (km)':'float',
+          'calories':'float', 'odometer (km)':'float', 'gear':'int',
+          'weight (kg)':'float'}
+
+# storage dtype for each kind of column
+kind_dtypes = {'date':'datetime64[D]', 'duration':'int64', 'float':'float64',
+               'int':'int64', 'str':object}
+
+
+def minsec_to_sec(s):
+    """ Convert 'MM:SS' (or 'MM') string to integer number of seconds. """
+    mn, _, sc = str(s).partition(':')
+    return 60 * int(float(mn or 0)) + int(float(sc or 0))
+
+def sec_to_minsec(sec):
+    """ Convert integer number of seconds to 'MM:SS' string. """
+    mn, sc = divmod(int(sec), 60)
+    return '{:02d}:{:02d}'.format(mn, sc)
+
+def format_float(f):
+    """ Format float as string, dropping the decimal point if `f` is integral.
+    """
+    f = float(f)
+    if f.is_integer():
+        return str(int(f))
+    return repr(f)
+
+def format_column(kind, values):
+    """ Return list of strings for array `values` of a column of `kind`,
+        formatted as for the csv file.
+    """
+    if kind == 'duration':
+        mins, secs = np.divmod(values.astype(np.int64), 60)
+        return ['{:02d}:{:02d}'.format(mn, sc)
+                for mn, sc in zip(mins.tolist(), secs.tolist())]
+    elif kind == 'date':
+        return np.datetime_as_string(values, unit='D').tolist()
+    elif kind == 'float':
+        return [format_float(f) for f in values.tolist()]
+    return [str(value) for value in values.tolist()]
+
+def _to_int(value):
+    """ Convert `value` to int, allowing floats with no fractional part. """
+    f = float(value)
+    if not f.is_integer():
+        raise ValueError(f"'{value}' is not an integer")
+    return int(f)
+
+
+def parse_value(kind, value):
+    """ Convert single `value` to the storage type for `kind`. """
+    if kind == 'duration':
+        return minsec_to_sec(value)
+    elif kind == 'date':
+        return np.datetime64(str(value), 'D')
+    elif kind == 'int':
+        return _to_int(value)
+    elif kind == 'float':
+        return float(value)
+    return str(value)
+
+
+def _parse_durations(values):
+    """ Convert list of 'MM:SS' strings to array of seconds. """
+    parts = ':'.join(values).split(':')
+    try:
+        if len(parts) != 2 * len(values):
+            raise ValueError
+        mins, secs = np.array(parts, dtype=np.int64).reshape(-1, 2).T
+    except ValueError:
+        # some values are 'MM', 'MM:' or ':SS'
+        parts = np.char.partition(np.array(values, dtype=str), ':')
+        mins = np.where(parts[:,0] == '', '0', parts[:,0]).astype(np.int64)
+        secs = np.where(parts[:,2] == '', '0', parts[:,2]).astype(np.int64)
+    return 60 * mins + secs
+
+def _parse_ints(values):
+    """ Convert list of strings to array of ints. """
+    try:
+        return np.array(values, dtype=np.int64)
+    except ValueError:
+        # may be written as floats, e.g. '5.0'
+        floats = np.array(values, dtype=np.float64)
+        if np.any(floats != np.round(floats)):
+            raise ValueError('non-integer value')
+        return floats.astype(np.int64)
+
+# bulk parser for each kind of column
+_parsers = {'date':lambda values: np.array(values, dtype='datetime64[D]'),
+            'duration':_parse_durations,
+            'float':lambda values: np.array(values, dtype=np.float64),
+            'int':_parse_ints,
+            'str':lambda values: np.array(values, dtype=object)}
+
+
+def parse_column(kind, values, name=''):
+    """ Convert list of strings to array for a column of `kind`.
+
+        If a value cannot be converted, raise ValueError giving the row index
+        and the column `name`.
+    """
+    if not isinstance(values, list):
+        values = list(values)
+    try:
+        return _parsers[kind](values)
+    except ValueError:
+        # find the first value which can't be parsed
+        for row, value in enumerate(values):
+            try:
+                parse_value(kind, value)
+            except ValueError:
+                raise ValueError(f"Invalid {kind} '{value}' in row {row} of "
+                                 f"column '{name}'") from None
+        raise
+
+
+def infer_kind(values):
+    """ Return kind of data in list of strings `values`.
+
+        Every value is checked, so the kind is 'int' only if every value is
+        an integer, otherwise 'float' if every value is a number, otherwise
+        'str'.
+    """
+    if not isinstance(values, list):
+        values = list(values)
+    for kind in ['int', 'float']:
+        try:
+            np.array(values, dtype=kind_dtypes[kind])
+            return kind
+        except ValueError:
+            pass
+    return 'str'
+
+
+def column_kinds(header, columns):
+    """ Return kind of each column, from the schema or inferred from `columns`.
+    """
+    return tuple(schema.get(name.lower()) or infer_kind(col)
+                 for name, col in zip(header, columns))
@@ -0,0 +1,453 @@
+"""
+Year-sharded storage for MyCycle
+
+The data are stored as one csv file per year, e.g. ~/.mycycle/mycycle-2020.csv.
+Only the current year is read on start up; older years are read on demand.
+
+A summary of every shard (monthly totals, best session and the streaks of
+consecutive days) is kept in mycycle-shards.json, so that lifetime personal
+bests can be found without reading every shard.
+
+An existing csv file can be split into shards with
+
+    python shardeddata.py split [csvfile]
+"""
+
+import argparse
+import glob
+import json
+import os.path
+import re
+from datetime import date
+import numpy as np
+from dataobject import Data, CsvChangedError
+from schema import kind_dtypes
+from undo import RowAdded
+from analysedata import hr_to_hrminsec, datefmt, fastest
+from calendargroup import month_label, date_label
+
+summary_name = 'mycycle-shards.json'
+
+
+def shard_path(path, year):
+    """ Return path of the shard for `year` in directory `path`. """
+    return os.path.join(path, f'mycycle-{year}.csv')
+
+
+def shard_years(path):
+    """ Return sorted list of years with a shard in directory `path`. """
+    years = []
+    for fname in glob.glob(os.path.join(path, 'mycycle-*.csv')):
+        match = re.search(r'mycycle-(\d{4})\.csv$', fname)
+        if match is not None:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+
+def read_summaries(path):
+    """ Return dict of shard summaries in directory `path`, keyed by year. """
+    fname = os.path.join(path, summary_name)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as fileobj:
+        summaries = json.load(fileobj)
+    return {int(year): summary for year, summary in summaries.items()}
+
+
+def write_summaries(path, summaries):
+    """ Write shard summaries to directory `path`. """
+    fname = os.path.join(path, summary_name)
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as fileobj:
+        json.dump({str(year): summaries[year] for year in sorted(summaries)},
+                  fileobj)
+    os.replace(tmp, fname)
+
+
+def write_shard(path, year, header, rows):
+    """ Write shard for `year` in directory `path`, with column names
+        `header` and list of csv lines `rows`.
+    """
+    fname = shard_path(path, year)
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as fileobj:
+        fileobj.write(header + '\n' + ''.join(row + '\n' for row in rows))
+    os.replace(tmp, fname)
+
+
+def _year(value):
+    """ Return year of date `value`. """
+    return int(np.datetime64(str(value), 'D').astype('datetime64[Y]')
+               .astype(int)) + 1970
+
+
+def _years(dates):
+    """ Return array of the year of every date in `dates`. """
+    return dates.astype('datetime64[Y]').astype(int) + 1970
+
+
+def summarise(dates, time, dist, cal):
+    """ Return summary of one shard.
+
+        Parameters
+        ----------
+        dates : array of datetime64[D]
+        time : array of durations in seconds
+        dist, cal : arrays of distance and calories
+    """
+    if len(dates) == 0:
+        return None
+
+    # totals for each month
+    months = dates.astype('datetime64[M]').astype(int) % 12 + 1
+    counts = np.bincount(months, minlength=13)
+    totals = [np.bincount(months, weights=w, minlength=13)
+              for w in [time, dist, cal]]
+    month_totals = {str(m): [int(counts[m]), int(totals[0][m]),
+                             float(totals[1][m]), float(totals[2][m])]
+                    for m in np.flatnonzero(counts)}
+
+    # best average speed, if any session has a time
+    best, speed = fastest(time, dist)
+
+    # runs of consecutive days
+    days = np.unique(dates)
+    breaks = np.flatnonzero(np.diff(days.astype(int)) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(days) - 1]))
+    lengths = ends - starts + 1
+    # most recent of the longest runs
+    longest = len(lengths) - 1 - int(np.argmax(lengths[::-1]))
+
+    summary = {'sessions':len(dates), 'first':str(days[0]),
+               'last':str(days[-1]), 'months':month_totals,
+               'best_session':[speed, None if best is None
+                               else str(dates[best])],
+               'streak':[int(lengths[longest]), str(days[starts[longest]]),
+                         str(days[ends[longest]])],
+               'head':int(lengths[0]), 'tail':int(lengths[-1])}
+    return summary
+
+
+def split(csvfile, path=None):
+    """ Split `csvfile` into one shard per year and write the summaries.
+
+        The shards are written to `path`, which is the directory containing
+        `csvfile` by default.
+    """
+    if path is None:
+        path = os.path.dirname(csvfile)
+
+    # sessions saved to the journal are included
+    data = Data(csvfile, journal=True)
+    if data.journal_conflict:
+        raise ValueError(f"'{data.journalfile}' doesn't match '{csvfile}'; "
+                         "open MyCycle to apply or discard it first")
+    header = ','.join(data.columns)
+    summaries = {}
+
+    if len(data) > 0:
+        dates = data.getColumn('date')
+        years = _years(dates)
+        for year in np.unique(years):
+            idx = np.flatnonzero(years == year)
+            write_shard(path, year, header,
+                        [data._rowString(n) for n in idx])
+            summaries[int(year)] = summarise(
+                dates[idx], *(data.getColumn(key)[idx]
+                              for key in ['time', 'distance (km)', 'calories']))
+
+    write_summaries(path, summaries)
+
+
+def _merge_kinds(kinds0, kinds1):
+    """ Return kinds that can hold data of both `kinds0` and `kinds1`. """
+    kinds = []
+    for k0, k1 in zip(kinds0, kinds1):
+        if k0 == k1:
+            kinds.append(k0)
+        elif {k0, k1} == {'int', 'float'}:
+            kinds.append('float')
+        else:
+            kinds.append('str')
+    return tuple(kinds)
+
+
+class ShardedData(Data):
+
+    def __init__(self, path, year=None, readonly=False):
+        """ Data stored as one csv file per year in directory `path`.
+
+            Only the shard for `year` (by default, the current year) is read
+            initially. Other years are read by `loadYear` or `loadAll`, or
+            when a session from that year is added.
+            `best_session`, `best_month` and `longest_streak` use the shard
+            summaries, so they do not need every shard to be read.
+            If `readonly` is True, no shard is made or written.
+        """
+        if year is None:
+            year = date.today().year
+
+        self.path = path
+        self.year = year
+        self.summaries = read_summaries(path)
+        self.years = sorted(set(shard_years(path)) | set(self.summaries))
+        self.loaded = {year}
+
+        super().__init__(shard_path(path, year), readonly=readonly)
+
+
+    def loadYear(self, year):
+        """ Read the shard for `year`, if it isn't loaded already.
+
+            The rows are inserted before any rows from later years. Returns
+            the index of the first new row and the number of rows.
+        """
+        if year in self.loaded:
+            return 0, 0
+        self.loaded.add(year)
+
+        fname = shard_path(self.path, year)
+        if not os.path.exists(fname):
+            return 0, 0
+
+        kinds = self.kinds
+        with open(fname) as fileobj:
+            _, columns = self._parse(fileobj.read())
+
+        if columns is None:
+            self.kinds = kinds
+            return 0, 0
+
+        num = len(columns[0])
+
+        rows = self._read_rows
+        if kinds is None or self._len == 0:
+            self._setColumns(columns, rows)
+            self.history.shiftRows(0, num)
+            self._rowsLoaded(0, num)
+            return 0, num
+
+        if kinds != self.kinds:
+            self.kinds = _merge_kinds(kinds, self.kinds)
+
+        old = [col[:self._len] for col in self._data]
+        date_idx = self._getColumnIndex('date')
+        pos = int(np.sum(_years(old[date_idx]) < year))
+
+        new = []
+        for kind, col0, col1 in zip(self.kinds, old, columns):
+            dtype = kind_dtypes[kind]
+            new.append(np.concatenate((col0[:pos].astype(dtype),
+                                       col1.astype(dtype),
+                                       col0[pos:].astype(dtype))))
+        if self._row_strings is not None and rows is not None:
+            rows = self._row_strings[:pos] + rows + self._row_strings[pos:]
+        else:
+            rows = None
+        self._setColumns(new, rows)
+        self.history.shiftRows(pos, num)
+        self._rowsLoaded(pos, num)
+
+        return pos, num
+
+
+    def _rowsLoaded(self, pos, num):
+        """ Tell the listeners about `num` rows read into index `pos`.
+
+            These are not changes to the data, so they can't be undone.
+        """
+        self._notify([RowAdded(idx, self.getRow(idx))
+                      for idx in range(pos, pos+num)])
+
+
+    def loadAll(self):
+        """ Read every shard. """
+        for year in self.years:
+            self.loadYear(year)
+
+
+    def addRow(self, row):
+        """ Add new row to Data, reading the shard for its year if needed. """
+        self.loadYear(_year(row[self._getColumnIndex('date')]))
+        super().addRow(row)
+
+
+    def insertRow(self, idx, row):
+        """ Insert new row before row `idx`, reading the shard for its year if
+            needed.
+        """
+        if idx < 0:
+            idx += self._len
+        pos, num = self.loadYear(_year(row[self._getColumnIndex('date')]))
+        if idx >= pos:
+            idx += num
+        super().insertRow(idx, row)
+
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, tuple):
+            raise ValueError('Indices should be tuple')
+        idx0, idx1 = key
+        idx1 = self._getColumnIndex(idx1)
+        if self.kinds is not None and self.kinds[idx1] == 'date':
+            # moving a session to another year; make sure that year is read
+            idx0 = self._checkRowIndex(idx0)
+            pos, num = self.loadYear(_year(value))
+            if idx0 >= pos:
+                idx0 += num
+        super().__setitem__((idx0, idx1), value)
+
+
+    def reload(self):
+        """ Read the shard for the current year again, discarding any unsaved
+            changes. Other years are read again when needed.
+        """
+        self.loaded = {self.year}
+        super().reload()
+
+
+    def save(self, force=False):
+        """ Write the shards for every loaded year and update the summaries.
+
+            Rows appended to the current year's shard by another program are
+            merged first. If it has been changed in any other way,
+            CsvChangedError is raised, unless `force` is True.
+        """
+        if self.readonly:
+            raise PermissionError(f"'{self.path}' was opened read-only")
+        if not force:
+            self.checkFile()
+        if not self.modified:
+            return False
+        if self.externally_modified and not force:
+            raise CsvChangedError(f"'{self.csvfile}' has been changed by "
+                                  "another program")
+
+        header = ','.join(self.columns)
+        years = _years(self.getColumn('date'))
+        self.loaded.update(int(year) for year in np.unique(years))
+
+        for year in sorted(self.loaded):
+            idx = np.flatnonzero(years == year)
+            if len(idx) == 0 and year not in self.years:
+                continue
+            write_shard(self.path, year, header,
+                        [self._rowString(n) for n in idx])
+
+        self.summaries = self._allSummaries()
+        write_summaries(self.path, self.summaries)
+
+        self.years = sorted(set(self.years) | set(self.summaries))
+        self.modified = False
+        self._markFile()
+        return True
+
+
+    def _allSummaries(self):
+        """ Return summaries of every shard, with those for the loaded years
+            computed from the data in memory.
+        """
+        summaries = {year: summary for year, summary in self.summaries.items()
+                     if year not in self.loaded}
+
+        if len(self) > 0:
+            dates = self.getColumn('date')
+            years = _years(dates)
+            cols = [self.getColumn(key)
+                    for key in ['time', 'distance (km)', 'calories']]
+            for year in self.loaded:
+                idx = np.flatnonzero(years == year)
+                summary = summarise(dates[idx], *(col[idx] for col in cols))
+                if summary is not None:
+                    summaries[year] = summary
+
+        return summaries
+
+
+    def best_session(self):
+        """ Return best average speed and the date it was achieved. """
+        best = None
+        when = ''
+        for year, summary in sorted(self._allSummaries().items()):
+            speed, day = summary['best_session']
+            if day is not None and (best is None or speed > best):
+                best = speed
+                when = date_label(day)
+        if best is None:
+            return 0, ''
+        return best, when
+
+
+    def best_month(self):
+        """ Return greatest monthly distance, the month, total time and
+            calories.
+        """
+        best = 0
+        when = ''
+        time = ''
+        cal = 0
+        for year, summary in sorted(self._allSummaries().items()):
+            for month, totals in sorted(summary['months'].items(),
+                                        key=lambda item: int(item[0])):
+                _, secs, dist, cals = totals
+                if dist > best:
+                    best = dist
+                    when = month_label(year, month)
+                    time = hr_to_hrminsec(secs / 3600)
+                    cal = cals
+        return best, when, time, cal
+
+
+    def longest_streak(self):
+        """ Return length, first and last date of longest run of consecutive
+            days, including runs which cross from one year into the next.
+        """
+        one_day = np.timedelta64(1, 'D')
+        best = (0, None, None)
+        # run of consecutive days up to the end of the previous shard
+        run_len = 0
+        run_first = None
+        prev_last = None
+
+        for year, summary in sorted(self._allSummaries().items()):
+            first = np.datetime64(summary['first'])
+            last = np.datetime64(summary['last'])
+            head = summary['head']
+            tail = summary['tail']
+
+            joined = prev_last is not None and first - prev_last == one_day
+            if joined and run_len + head >= best[0]:
+                best = (run_len + head, run_first, first + (head-1) * one_day)
+
+            length, start, end = summary['streak']
+            if length >= best[0]:
+                best = (length, np.datetime64(start), np.datetime64(end))
+
+            # whole shard is a single run
+            if joined and first + (head-1) * one_day == last:
+                run_len += head
+            else:
+                run_len = tail
+                run_first = last - (tail-1) * one_day
+            prev_last = last
+
+        duration, first, last = best
+        if duration == 0:
+            return 0, '', ''
+        first, last = (d.astype(object).strftime(datefmt) for d in [first, last])
+        return duration, first, last
+
+
+if __name__ == '__main__':
+
+    home = os.path.expanduser('~')
+
+    parser = argparse.ArgumentParser(description='Split MyCycle csv into '
+                                                 'one file per year.')
+    parser.add_argument('command', choices=['split'])
+    parser.add_argument('csvfile', nargs='?',
+                        default=os.path.join(home, '.mycycle', 'mycycle.csv'))
+    args = parser.parse_args()
+
+    split(args.csvfile)
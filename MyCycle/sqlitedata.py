@@ -0,0 +1,343 @@
+"""
+SQLite storage backend for MyCycle
+
+Sessions are stored in a local SQLite database, with an index on the date
+column. Every change is written as a single-row transaction, so there is no
+need to rewrite the whole file on saving.
+
+An existing csv file can be copied into a new database with
+
+    python sqlitedata.py migrate [csvfile] [dbfile]
+"""
+
+import argparse
+import os.path
+import sqlite3
+import numpy as np
+from dataobject import Data
+from schema import default_columns, kind_dtypes
+
+# SQL column type for each kind of column
+kind_sqltypes = {'date':'TEXT', 'duration':'INTEGER', 'float':'REAL',
+                 'int':'INTEGER', 'str':'TEXT', None:''}
+
+
+def _quote(name):
+    """ Quote column name for use in SQL. """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def create_tables(conn, header, kinds=None):
+    """ Create tables for data with column names `header` and `kinds`. """
+    if kinds is None:
+        kinds = [None] * len(header)
+
+    conn.execute('CREATE TABLE columns (position INTEGER PRIMARY KEY, '
+                 'name TEXT, kind TEXT)')
+    conn.executemany('INSERT INTO columns (name, kind) VALUES (?, ?)',
+                     zip(header, kinds))
+
+    cols = ', '.join(f'{_quote(name)} {kind_sqltypes[kind]}'
+                     for name, kind in zip(header, kinds))
+    conn.execute(f'CREATE TABLE sessions (id INTEGER PRIMARY KEY, {cols})')
+
+    for name in header:
+        if name.lower() == 'date':
+            conn.execute(f'CREATE INDEX sessions_date ON sessions '
+                         f'({_quote(name)})')
+
+
+def migrate(csvfile, dbfile):
+    """ Copy all data from `csvfile` into new database `dbfile`.
+
+        Sessions saved to the csv's journal are included.
+    """
+    if os.path.exists(dbfile):
+        raise FileExistsError(f"'{dbfile}' already exists")
+
+    data = Data(csvfile, journal=True)
+    if data.journal_conflict:
+        raise ValueError(f"'{data.journalfile}' doesn't match '{csvfile}'; "
+                         "open MyCycle to apply or discard it first")
+
+    conn = sqlite3.connect(dbfile)
+    with conn:
+        create_tables(conn, data.columns, data.kinds)
+        if len(data) > 0:
+            columns = [data.getColumn(n) for n in range(data.shape[1])]
+            columns = [col.astype(str).tolist() if kind == 'date'
+                       else col.tolist()
+                       for kind, col in zip(data.kinds, columns)]
+            names = ', '.join(_quote(name) for name in data.columns)
+            params = ', '.join('?' * data.shape[1])
+            conn.executemany(f'INSERT INTO sessions ({names}) '
+                             f'VALUES ({params})', zip(*columns))
+    conn.close()
+
+
+class SQLiteData(Data):
+
+    def __init__(self, fname, readonly=False):
+        """ Data object stored in SQLite database `fname`.
+
+            The whole Data API is available; the data are also held in
+            memory as columns, so `getColumn` is as cheap as for csv data.
+            Changes are committed to the database as they are made.
+            Monthly and date range totals are computed by SQLite (see
+            `totals` and `monthly_totals`, which `report` uses).
+            If `readonly` is True, the database is opened read-only.
+        """
+        # database id of each row
+        self._ids = []
+        self.conn = None
+        super().__init__(fname, readonly=readonly)
+
+
+    @staticmethod
+    def csv_exists(fname):
+        """ Make new, empty database if `fname` does not exist. """
+        if not os.path.exists(fname):
+            d = os.path.split(fname)[0]
+            os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(fname)
+            with conn:
+                create_tables(conn, default_columns)
+            conn.close()
+
+        return True
+
+
+    def read(self):
+        """ Read database and return list of headers and list of columns. """
+
+        # on reload, the connection is opened again
+        if self.conn is not None:
+            self.conn.close()
+        self._ids = []
+
+        if self.readonly:
+            uri = 'file:{}?mode=ro'.format(os.path.abspath(self.csvfile))
+            self.conn = sqlite3.connect(uri, uri=True)
+        else:
+            self.conn = sqlite3.connect(self.csvfile)
+
+        meta = self.conn.execute('SELECT name, kind FROM columns '
+                                 'ORDER BY position').fetchall()
+        header = [name for name, _ in meta]
+        kinds = tuple(kind for _, kind in meta)
+
+        if None in kinds:
+            # there is no data yet
+            self.kinds = None
+            return header, None
+
+        self.kinds = kinds
+
+        names = ', '.join(_quote(name) for name in header)
+        rows = self.conn.execute(f'SELECT id, {names} FROM sessions '
+                                 'ORDER BY id').fetchall()
+
+        if rows:
+            ids, *columns = zip(*rows)
+            self._ids = list(ids)
+        else:
+            columns = [[]] * len(header)
+
+        columns = [np.array(col, dtype=kind_dtypes[kind])
+                   for kind, col in zip(kinds, columns)]
+
+        return header, columns
+
+
+    def save(self):
+        """ Changes are committed as they are made, so nothing is written.
+
+            Returns True if there were changes since the last call.
+        """
+        saved = self.modified
+        self.modified = False
+        return saved
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def checkFile(self):
+        """ The database is only changed through this object, so there is
+            nothing to check.
+        """
+        return False
+
+
+    def _sqlValue(self, idx, value):
+        """ Convert storage `value` from column `idx` for SQLite. """
+        kind = self.kinds[idx]
+        if kind == 'date':
+            return str(value)
+        elif kind in ['duration', 'int']:
+            return int(value)
+        elif kind == 'float':
+            return float(value)
+        return str(value)
+
+
+    def _sqlName(self, key):
+        """ Return quoted name of column `key`. """
+        return _quote(self.columns[self._getColumnIndex(key)])
+
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        idx0, idx1 = key
+        idx0 = self._checkRowIndex(idx0)
+        idx1 = self._getColumnIndex(idx1)
+        value = self._sqlValue(idx1, self._data[idx1][idx0])
+        with self.conn:
+            self.conn.execute(f'UPDATE sessions SET {self._sqlName(idx1)} = ? '
+                              'WHERE id = ?', (value, self._ids[idx0]))
+
+
+    def addRow(self, row):
+        new_kinds = self.kinds is None
+        super().addRow(row)
+        idx = self._len - 1
+        values = [self._sqlValue(n, col[idx]) for n, col in enumerate(self._data)]
+        names = ', '.join(_quote(name) for name in self.columns)
+        params = ', '.join('?' * len(values))
+        with self.conn:
+            if new_kinds:
+                self.conn.executemany('UPDATE columns SET kind = ? '
+                                      'WHERE name = ?',
+                                      zip(self.kinds, self.columns))
+            cursor = self.conn.execute(f'INSERT INTO sessions ({names}) '
+                                       f'VALUES ({params})', values)
+        self._ids.append(cursor.lastrowid)
+
+
+    def insertRow(self, idx, row):
+        """ Insert new row before row `idx`.
+
+            The new row is given an id between those of its neighbours, and
+            the ids are spread out again when there is no room.
+
+            Examples
+            --------
+            >>> import tempfile
+            >>> db = SQLiteData(os.path.join(tempfile.mkdtemp(), 'test.db'))
+            >>> row = ['2024-05-01', '30:00', 10, 200, 100, 5, 70]
+            >>> db.addRow(row)
+            >>> for idx in [0, 0, 1, 0, 2]:
+            ...     db.insertRow(idx, row)
+            >>> len(db), db._ids == sorted(set(db._ids)), min(db._ids) > 0
+            (6, True, True)
+        """
+        if idx < 0:
+            idx += self._len
+        if idx == self._len:
+            self.addRow(row)
+            return
+        idx = self._checkRowIndex(idx)
+        # rows are ordered by id, so the new row needs an id between those
+        # of its neighbours (or, at the start, a positive id before the first)
+        prev = self._ids[idx-1] if idx > 0 else 0
+        if self._ids[idx] - prev < 2:
+            self._spreadIds()
+        super().insertRow(idx, row)
+        new_id = self._ids[idx] - 1
+        values = [self._sqlValue(n, col[idx]) for n, col in enumerate(self._data)]
+        names = ', '.join(_quote(name) for name in self.columns)
+        params = ', '.join('?' * len(values))
+        with self.conn:
+            self.conn.execute(f'INSERT INTO sessions (id, {names}) '
+                              f'VALUES (?, {params})', [new_id] + values)
+        self._ids.insert(idx, new_id)
+
+
+    def _spreadIds(self):
+        """ Renumber rows so that there is a free id between every pair. """
+        new_ids = [2 * (n+1) for n in range(len(self._ids))]
+        # move every row past the new ids first, so that no new id clashes
+        # with an old one
+        offset = max(abs(i) for i in self._ids) + new_ids[-1] + 1
+        with self.conn:
+            self.conn.execute('UPDATE sessions SET id = id + ?', (offset,))
+            self.conn.executemany('UPDATE sessions SET id = ? WHERE id = ?',
+                                  zip(new_ids, [i + offset for i in self._ids]))
+        self._ids = new_ids
+
+
+    def removeRow(self, idx):
+        idx = self._checkRowIndex(idx)
+        super().removeRow(idx)
+        with self.conn:
+            self.conn.execute('DELETE FROM sessions WHERE id = ?',
+                              (self._ids[idx],))
+        del self._ids[idx]
+
+
+    def _dateRange(self, start, end):
+        """ Return SQL WHERE clause and parameters for dates in [start, end].
+        """
+        date = self._sqlName('date')
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append(f'{date} >= ?')
+            params.append(str(start))
+        if end is not None:
+            clauses.append(f'{date} <= ?')
+            params.append(str(end))
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return where, params
+
+
+    def _totalsColumns(self):
+        """ Return SQL for number of sessions and total time, distance and
+            calories.
+        """
+        names = [self._sqlName(key)
+                 for key in ['time', 'distance (km)', 'calories']]
+        return 'COUNT(*), ' + ', '.join(f'TOTAL({name})' for name in names)
+
+
+    def totals(self, start=None, end=None):
+        """ Return number of sessions and total time (in seconds), distance
+            and calories between dates `start` and `end` (inclusive).
+
+            Either date may be None, to leave the range open at that end.
+        """
+        where, params = self._dateRange(start, end)
+        num, time, dist, cal = self.conn.execute(
+            f'SELECT {self._totalsColumns()} FROM sessions {where}',
+            params).fetchone()
+        return num, int(time), dist, cal
+
+
+    def monthly_totals(self, start=None, end=None):
+        """ Return list of ('YYYY-MM', sessions, time, distance, calories)
+            tuples, in date order, for dates between `start` and `end`.
+        """
+        where, params = self._dateRange(start, end)
+        month = f'substr({self._sqlName("date")}, 1, 7)'
+        rows = self.conn.execute(
+            f'SELECT {month} AS month, {self._totalsColumns()} FROM sessions '
+            f'{where} GROUP BY month ORDER BY month', params).fetchall()
+        return [(m, num, int(time), dist, cal)
+                for m, num, time, dist, cal in rows]
+
+
+if __name__ == '__main__':
+
+    home = os.path.expanduser('~')
+    path = os.path.join(home, '.mycycle')
+
+    parser = argparse.ArgumentParser(description='MyCycle SQLite database.')
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('csvfile', nargs='?',
+                        default=os.path.join(path, 'mycycle.csv'))
+    parser.add_argument('dbfile', nargs='?',
+                        default=os.path.join(path, 'mycycle.db'))
+    args = parser.parse_args()
+
+    migrate(args.csvfile, args.dbfile)
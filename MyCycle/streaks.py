@@ -0,0 +1,152 @@
+"""
+Streaks of consecutive days with a session
+
+The dates are converted to day numbers once, and the runs of consecutive
+days are found with one diff of the sorted, unique days. New days can then
+be appended without finding the runs again.
+"""
+
+import numpy as np
+
+
+def find_runs(days):
+    """ Return arrays of the first and last day of each run of consecutive
+        days in sorted array of unique day numbers `days`.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    if len(days) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    firsts = days[np.concatenate(([0], breaks + 1))]
+    lasts = days[np.concatenate((breaks, [len(days) - 1]))]
+    return firsts, lasts
+
+
+class Streaks:
+
+    def __init__(self, dates=()):
+        """ Runs of consecutive days in array of datetime64 `dates`.
+
+            The dates need not be sorted or unique. Runs are returned as
+            (number of days, first day, last day), with the days as
+            datetime64[D], or (0, None, None) if there are none.
+        """
+        days = np.unique(np.asarray(dates, dtype='datetime64[D]')
+                         .astype(np.int64))
+        firsts, lasts = find_runs(days)
+        self._firsts = firsts.tolist()
+        self._lasts = lasts.tolist()
+        # index of the longest run
+        self._longest = self._findLongest()
+
+    @classmethod
+    def fromData(cls, data):
+        """ Return Streaks of the date column of Data object `data`. """
+        return cls(data.getColumn('date'))
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def _findLongest(self):
+        """ Return index of the longest run, the most recent if there is a
+            tie, or None if there are no runs.
+        """
+        if not self._firsts:
+            return None
+        lengths = np.array(self._lasts) - np.array(self._firsts)
+        # the last of the longest
+        return len(lengths) - 1 - int(np.argmax(lengths[::-1]))
+
+    def _run(self, idx):
+        """ Return (days, first, last) of run `idx`. """
+        if idx is None:
+            return 0, None, None
+        first, last = self._firsts[idx], self._lasts[idx]
+        return (last - first + 1, np.datetime64(first, 'D'),
+                np.datetime64(last, 'D'))
+
+    def append(self, date):
+        """ Add `date`, which is usually on or after the last day.
+
+            An earlier date means the runs have to be found again.
+        """
+        day = int(np.datetime64(str(date), 'D').astype(np.int64))
+        if not self._lasts or day > self._lasts[-1] + 1:
+            self._firsts.append(day)
+            self._lasts.append(day)
+        elif day == self._lasts[-1] + 1:
+            self._lasts[-1] = day
+        elif day < self._firsts[-1]:
+            days = np.concatenate([np.arange(first, last + 1)
+                                   for first, last in zip(self._firsts,
+                                                          self._lasts)]
+                                  + [[day]])
+            firsts, lasts = find_runs(np.unique(days))
+            self._firsts = firsts.tolist()
+            self._lasts = lasts.tolist()
+            self._longest = self._findLongest()
+            return
+        else:
+            # already in the last run
+            return
+
+        # the last run is the longest if it is at least as long
+        idx = len(self._firsts) - 1
+        if (self._longest is None or self._lasts[idx] - self._firsts[idx]
+                >= self._lasts[self._longest] - self._firsts[self._longest]):
+            self._longest = idx
+
+    def longest(self):
+        """ Return the longest run; the most recent, if there is a tie. """
+        return self._run(self._longest)
+
+    def current(self, today=None):
+        """ Return the run which includes `today` (by default, the current
+            date), or ends the day before it.
+        """
+        if today is None:
+            today = np.datetime64('today', 'D')
+        today = int(np.datetime64(str(today), 'D').astype(np.int64))
+        # the last run starting on or before today
+        idx = int(np.searchsorted(self._firsts, today, side='right')) - 1
+        if idx < 0 or self._lasts[idx] < today - 1:
+            return self._run(None)
+        # runs after today don't count
+        first, last = self._firsts[idx], min(self._lasts[idx], today)
+        return (last - first + 1, np.datetime64(first, 'D'),
+                np.datetime64(last, 'D'))
+
+    def byYear(self):
+        """ Return dict of the longest run in each year.
+
+            Runs which span the new year are split, so each year only counts
+            its own days.
+        """
+        if not self._firsts:
+            return {}
+        firsts = np.array(self._firsts).astype('datetime64[D]')
+        lasts = np.array(self._lasts).astype('datetime64[D]')
+        first_years = firsts.astype('datetime64[Y]').astype(np.int64)
+        last_years = lasts.astype('datetime64[Y]').astype(np.int64)
+
+        # one piece of each run for each year it is in
+        pieces = last_years - first_years + 1
+        run = np.repeat(np.arange(len(firsts)), pieces)
+        offset = np.arange(len(run)) - np.repeat(np.cumsum(pieces) - pieces,
+                                                 pieces)
+        years = first_years[run] + offset
+        starts = np.maximum(firsts[run],
+                            years.astype('datetime64[Y]')
+                            .astype('datetime64[D]'))
+        ends = np.minimum(lasts[run],
+                          (years + 1).astype('datetime64[Y]')
+                          .astype('datetime64[D]') - np.timedelta64(1, 'D'))
+        lengths = (ends - starts).astype(np.int64) + 1
+
+        # the longest in each year, then the most recent
+        order = np.lexsort((starts, lengths, years))
+        last_of_year = np.flatnonzero(np.diff(np.append(years[order],
+                                                      years.max() + 1)))
+        best = order[last_of_year]
+        return {int(years[n]) + 1970: (int(lengths[n]), starts[n], ends[n])
+                for n in best}
@@ -0,0 +1,209 @@
+"""
+Table model of the data for a QTableView, grouped by month.
+
+Each month starts with a header row giving its totals, as in the html view.
+Cells are only formatted when the view asks for them, and rows are added to
+the view in batches as it is scrolled, so the cost of showing the data depends
+on the number of visible rows, rather than the number of sessions.
+"""
+
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QFont
+from calendargroup import group_by, key_label, date_label
+from processcsv import get_hr_min_sec
+from schema import format_float, table_columns
+from undo import CellChanged, RowAdded, Reloaded
+
+class MonthTableModel(QAbstractTableModel):
+
+    # number of rows added to the view by each call of fetchMore
+    batch = 200
+
+    def __init__(self, data, parent=None):
+        """ Model of Data object `data`, most recent month first.
+
+            The model updates itself when `data` changes.
+        """
+        super().__init__(parent)
+        self._data = data
+        # number of rows the view has been given so far
+        self._loaded = 0
+        self._build()
+        self._data.subscribe(self._dataChanged)
+
+    def _build(self):
+        """ Find the order of the rows and the totals for each month. """
+        # most recent first; same day sessions in reverse order, as in the
+        # html view
+        months = group_by(self._data, 'month', reverse=True)
+        num = len(months.order)
+        starts = months.starts
+        ngroups = len(months)
+
+        # table row of each month header; the header of month n is stored as
+        # -1-n and every other row as the index of its session in the data
+        headers = starts + np.arange(ngroups)
+        is_header = np.zeros(num + ngroups, dtype=bool)
+        is_header[headers] = True
+        self._rows = np.empty(num + ngroups, dtype=np.int64)
+        self._rows[is_header] = -1 - np.arange(ngroups)
+        self._rows[~is_header] = months.order
+
+        self._months = months.keys
+        self._counts = months.counts
+        self._totals = [months.totals[name]
+                        for name in ['time', 'calories', 'distance (km)']]
+
+    def _idents(self):
+        """ Return array which identifies each row of the table: twice the
+            index of a session in the data, or twice the key of a month plus
+            one for a month header.
+        """
+        is_header = self._rows < 0
+        idents = self._rows * 2
+        idents[is_header] = self._months[-1 - self._rows[is_header]] * 2 + 1
+        return idents
+
+    def _dataChanged(self, changes):
+        """ Update the rows when the data change.
+
+            Rows are inserted or removed where sessions were added or removed
+            and edited rows are updated, so the view keeps its scroll position
+            and selection. The model is only reset if a date was edited or
+            the data were reloaded.
+        """
+        date_idx = self._data.aliases.index('date')
+        cells = [isinstance(change, CellChanged) for change in changes]
+        if (any(isinstance(change, Reloaded) for change in changes)
+                or any(change.col == date_idx for change, cell
+                       in zip(changes, cells) if cell)
+                or (any(cells) and not all(cells))):
+            # rows have moved between months, or row numbers of the edited
+            # cells may have moved
+            self.beginResetModel()
+            self._build()
+            self._loaded = min(max(self._loaded, self.batch), len(self._rows))
+            self.endResetModel()
+            return
+
+        old = self._idents()
+        # sessions of the old rows, with their rows in the data after the
+        # changes, or -1 if they were removed
+        is_session = old % 2 == 0
+        rows = np.where(is_session, old // 2, -1)
+        months = set()
+        for change in changes:
+            if isinstance(change, CellChanged):
+                months.add(int(np.datetime64(self._data[change.row, 'date'],
+                                             'M').astype(np.int64)))
+                continue
+            months.add(int(np.datetime64(change.values[date_idx], 'M')
+                           .astype(np.int64)))
+            if isinstance(change, RowAdded):
+                rows[rows >= change.row] += 1
+            else:
+                rows[rows == change.row] = -1
+                rows[rows > change.row] -= 1
+        old = np.where(is_session, rows * 2, old)
+        gone = is_session & (rows < 0)
+
+        self._build()
+        new = self._idents()
+
+        # remove rows from the end, so the earlier positions are unchanged
+        removed = np.flatnonzero(gone | (~is_session & ~np.isin(old, new)))
+        for row in removed[::-1].tolist():
+            if row < self._loaded:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self._loaded -= 1
+                self.endRemoveRows()
+        for row in np.flatnonzero(~np.isin(new, old[~gone])).tolist():
+            if row <= self._loaded:
+                self.beginInsertRows(QModelIndex(), row, row)
+                self._loaded += 1
+                self.endInsertRows()
+
+        # headers of the changed months, and edited rows
+        changed = np.isin(new, [key * 2 + 1 for key in months])
+        changed[np.isin(new, [change.row * 2 for change, cell
+                              in zip(changes, cells) if cell])] = True
+        for row in np.flatnonzero(changed[:self._loaded]).tolist():
+            self.dataChanged.emit(self.index(row, 0),
+                                  self.index(row, len(table_columns)-1))
+
+    def isHeader(self, row):
+        """ Return True if `row` of the table is a month header. """
+        return self._rows[row] < 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(table_columns)
+
+    def canFetchMore(self, parent):
+        if parent.isValid():
+            return False
+        return self._loaded < len(self._rows)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        num = min(self.batch, len(self._rows) - self._loaded)
+        if num <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded+num-1)
+        self._loaded += num
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self._data.columns[self._data.aliases.index(
+                table_columns[section])]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded:
+            return None
+
+        row = int(self._rows[index.row()])
+        if row < 0:
+            if role == Qt.DisplayRole and index.column() == 0:
+                return self._headerText(-1 - row)
+            elif role == Qt.FontRole:
+                font = QFont()
+                font.setBold(True)
+                return font
+            return None
+
+        if role == Qt.DisplayRole:
+            return self._cellText(row, index.column())
+        elif role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def _headerText(self, group):
+        """ Return text of the header for month number `group`. """
+        time, cal, dist = (total[group] for total in self._totals)
+        text = [f"{self._counts[group]} sessions", get_hr_min_sec(int(time)),
+                f"{dist:.2f} km", f"{cal:.2f} cal"]
+        return (key_label('month', self._months[group]) + ": "
+                + ", ".join(text))
+
+    def _cellText(self, row, column):
+        """ Return text for `column` of session `row`, as in the html view.
+        """
+        name = table_columns[column]
+        value = self._data[row, name]
+        if name == 'date':
+            return date_label(value, short=True)
+        elif name in ['distance (km)', 'calories', 'odometer (km)']:
+            return str(float(value))
+        elif isinstance(value, float):
+            return format_float(value)
+        return str(value)
@@ -0,0 +1,335 @@
+"""
+Randomised checks that everything updated a change at a time agrees with
+finding it again from scratch
+
+Each test makes a few hundred random changes to the data (adding, inserting,
+removing and editing rows, in and out of undo groups, and undoing and redoing
+them) and after each one compares the incremental result with a full
+recompute, or with the file read again. The seeds are fixed, so a failure can
+be reproduced.
+
+    python -m unittest discover MyCycle
+
+The table model test is skipped if PyQt5 isn't installed.
+"""
+
+import os.path
+import random
+import tempfile
+import unittest
+import numpy as np
+from dataobject import Data
+from analysedata import get_best_session, get_best_month, get_best_days
+from leaderboard import Leaderboard, metrics
+from pbtracker import PBTracker
+from rolling import DailyTotals, columns as rolling_columns
+from schema import default_columns
+
+try:
+    from PyQt5.QtWidgets import QApplication
+except ImportError:
+    QApplication = None
+
+header = ','.join(default_columns) + '\n'
+
+
+class RandomChanges:
+    """ Random rows and changes to a Data object, from a fixed seed. """
+
+    def __init__(self, seed, first='2019-11-01', days=150, untimed=0.2):
+        self.random = random.Random(seed)
+        self.first = np.datetime64(first)
+        self.days = days
+        # fraction of sessions with no time, which have no average speed
+        self.untimed = untimed
+
+    def row(self):
+        """ Return list of values of a random session. """
+        rand = self.random
+        day = self.first + rand.randrange(self.days)
+        if rand.random() < self.untimed:
+            time = '00:00'
+        else:
+            time = f'{rand.randint(5, 90):02d}:{rand.randint(0, 59):02d}'
+        return [str(day), time, str(round(rand.uniform(1, 40), 2)),
+                str(round(rand.uniform(0, 900), 1)), '100.0',
+                str(rand.randint(1, 8)), '70.0']
+
+    def csv(self, num):
+        """ Return text of a csv file with `num` random sessions. """
+        return header + ''.join(','.join(self.row()) + '\n'
+                                for _ in range(num))
+
+    def change(self, data):
+        """ Make one random change to `data`. """
+        rand = self.random
+        r = rand.random()
+        num = len(data)
+        if r < .3:
+            data.addRow(self.row())
+        elif r < .4:
+            data.insertRow(rand.randrange(num + 1), self.row())
+        elif r < .55 and num > 1:
+            data.removeRow(rand.randrange(num))
+        elif r < .7 and num:
+            col = rand.randrange(6)
+            data[rand.randrange(num), default_columns[col]] = self.row()[col]
+        elif r < .85:
+            with data.undoGroup():
+                for _ in range(rand.randint(1, 4)):
+                    if rand.random() < .5 or len(data) < 3:
+                        data.addRow(self.row())
+                    else:
+                        data.removeRow(rand.randrange(len(data)))
+                    if rand.random() < .3:
+                        data[rand.randrange(len(data)), 'Distance (km)'] = 3.0
+        elif r < .95:
+            data.undo()
+        else:
+            data.redo()
+
+
+def rows(data):
+    """ Return list of every row of `data`. """
+    return [data.getRow(n) for n in range(len(data))]
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.csvfile = os.path.join(self._tmpdir.name, 'mycycle.csv')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def write(self, text, mode='w'):
+        with open(self.csvfile, mode) as fileobj:
+            fileobj.write(text)
+
+
+class TestJournal(TestCase):
+
+    def test_replay(self):
+        """ The csv and journal read again give the same rows, whether the
+            journal is replayed or has been folded into the csv.
+        """
+        changes = RandomChanges(1)
+        self.write(changes.csv(200))
+        data = Data(self.csvfile, journal=True, journal_limit=50)
+        for n in range(600):
+            changes.change(data)
+            if n % 7 == 0:
+                data.save()
+                again = Data(self.csvfile, journal=True, readonly=True)
+                self.assertEqual(rows(again), rows(data), n)
+        data.save()
+        self.assertEqual(rows(Data(self.csvfile)), rows(data))
+
+    def test_append(self):
+        """ Rows appended by another program are merged with the journaled
+            and unsaved changes.
+        """
+        changes = RandomChanges(2)
+        self.write(changes.csv(50))
+        data = Data(self.csvfile, journal=True)
+        for n in range(100):
+            for _ in range(3):
+                changes.change(data)
+            if n % 2 == 0:
+                data.save()
+            tail = ''.join(','.join(changes.row()) + '\n' for _ in range(2))
+            tailfile = os.path.join(self._tmpdir.name, 'tail.csv')
+            with open(tailfile, 'w') as fileobj:
+                fileobj.write(header + tail)
+            expected = rows(data) + rows(Data(tailfile))
+            self.write(tail, 'a')
+            self.assertTrue(data.checkFile(), n)
+            self.assertFalse(data.externally_modified, n)
+            self.assertEqual(rows(data), expected, n)
+            data.save()
+            self.assertEqual(rows(Data(self.csvfile, journal=True)),
+                             expected, n)
+
+
+class TestTailMerge(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # more than the first and last MiB, so an edit in the middle is only
+        # found by hashing the whole file
+        self.write(header + ''.join(f'2023-01-01,30:00,10.5,200,{n},5,70\n'
+                                    for n in range(100000)))
+
+    def test_append(self):
+        data = Data(self.csvfile)
+        self.write('2023-01-02,30:00,1,2,3,4,70\n', 'a')
+        self.assertTrue(data.checkFile())
+        self.assertEqual(len(data), 100001)
+        self.assertEqual(data[-1, 'odometer (km)'], 3)
+
+    def test_edit_and_append(self):
+        """ An edit before the old end of the file isn't taken for an append.
+        """
+        data = Data(self.csvfile)
+        with open(self.csvfile) as fileobj:
+            text = fileobj.read()
+        text = text.replace(',50000,', ',77777,', 1)
+        self.write(text + '2023-01-02,30:00,1,2,3,4,70\n')
+        self.assertTrue(data.checkFile())
+        self.assertEqual(len(data), 100001)
+        self.assertEqual(data[50000, 'odometer (km)'], 77777)
+
+    def test_unsaved(self):
+        """ Appended rows are merged with unsaved changes, which are only
+            written on saving.
+        """
+        data = Data(self.csvfile, journal=True)
+        data[0, 'distance (km)'] = 11
+        data.save()
+        data.addRow(['2023-01-05', '10:00', '1', '1', '1', '1', '70'])
+        with open(self.csvfile) as fileobj:
+            before = fileobj.read()
+        tail = '2023-01-03,30:00,3,200,3,5,70\n'
+        self.write(tail, 'a')
+        self.assertTrue(data.checkFile())
+        self.assertTrue(data.modified)
+        with open(self.csvfile) as fileobj:
+            self.assertEqual(fileobj.read(), before + tail)
+        self.assertTrue(data.save())
+        self.assertFalse(os.path.exists(data.journalfile))
+        self.assertEqual(rows(Data(self.csvfile)), rows(data))
+
+
+class TestTrackers(TestCase):
+
+    def changed(self, seed, check, num=1500):
+        """ Make `num` random changes to a new csv, calling `check(data, n)`
+            after each.
+        """
+        changes = RandomChanges(seed)
+        self.write(changes.csv(100))
+        data = Data(self.csvfile)
+        yield data
+        for n in range(num):
+            changes.change(data)
+            check(data, n)
+
+    def test_pbtracker(self):
+        def check(data, n):
+            self.assertEqual(
+                (tracker.bestSession(), tracker.bestMonth(),
+                 tracker.bestDays()),
+                (get_best_session(data), get_best_month(data),
+                 get_best_days(data)), n)
+
+        run = self.changed(1, check)
+        data = next(run)
+        tracker = PBTracker(data)
+        data.subscribe(tracker.update)
+        for _ in run:
+            pass
+
+    def test_leaderboard(self):
+        def check(data, n):
+            fresh = Leaderboard(data, k=5)
+            for metric in metrics:
+                self.assertEqual([value for value, _ in board.top(metric)],
+                                 [value for value, _ in fresh.top(metric)],
+                                 (n, metric))
+
+        run = self.changed(2, check)
+        data = next(run)
+        board = Leaderboard(data, k=5)
+        data.subscribe(board.update)
+        for _ in run:
+            pass
+
+    def test_daily_totals(self):
+        end = np.datetime64('2020-06-01')
+
+        def check(data, n):
+            fresh = DailyTotals.fromData(data, end=end)
+            totals.extend(end)
+            offset = int((fresh.start - totals.start).astype(np.int64))
+            for window in [1, 7, 30, 365]:
+                for name in rolling_columns:
+                    np.testing.assert_allclose(
+                        totals.total(name, window)[offset:offset+len(fresh)],
+                        fresh.total(name, window), atol=1e-6,
+                        err_msg=str((n, window, name)))
+                if totals.days[-1] == fresh.days[-1]:
+                    np.testing.assert_allclose(
+                        totals.latest(window), fresh.latest(window),
+                        err_msg=str((n, window)))
+
+        run = self.changed(3, check)
+        data = next(run)
+        totals = DailyTotals.fromData(data, end=end)
+        data.subscribe(lambda changes: totals.update(changes, data))
+        for _ in run:
+            pass
+
+
+@unittest.skipIf(QApplication is None, 'PyQt5 is not installed')
+class TestTableModel(TestCase):
+
+    def test_view(self):
+        """ The rows a view would hold, kept up to date only from the
+            model's signals, match the model built again.
+        """
+        from tablemodel import MonthTableModel
+        app = QApplication.instance() or QApplication([])
+
+        def rows_shown(model):
+            # month headers by month, and sessions by their calories
+            cal = model._data.getColumn('calories')
+            return [('month', int(model._months[-1-r])) if r < 0
+                    else ('session', float(cal[r])) for r in model._rows]
+
+        changes = RandomChanges(4, days=400, untimed=0)
+        self.write(changes.csv(300))
+        data = Data(self.csvfile)
+        model = MonthTableModel(data)
+        model.batch = 50
+        while model.canFetchMore(model.index(-1, -1)) and model._loaded < 120:
+            model.fetchMore(model.index(-1, -1))
+
+        log = []
+        model.rowsRemoved.connect(
+            lambda parent, first, last: log.append(('removed', first, last)))
+        model.rowsInserted.connect(
+            lambda parent, first, last: log.append(('inserted', first, last)))
+        model.dataChanged.connect(
+            lambda first, last: log.append(('changed', first.row(),
+                                            last.row())))
+        model.modelReset.connect(lambda: log.append(('reset',)))
+
+        for n in range(400):
+            view = rows_shown(model)[:model.rowCount()]
+            log.clear()
+            changes.change(data)
+            new = rows_shown(model)
+            for op in log:
+                if op[0] == 'reset':
+                    view = new[:model.rowCount()]
+                    break
+                _, first, last = op
+                if op[0] == 'removed':
+                    del view[first:last+1]
+                elif op[0] == 'inserted':
+                    view[first:first] = new[first:last+1]
+                else:
+                    # the view asks for the changed rows again
+                    view[first:last+1] = new[first:last+1]
+            self.assertEqual(view, new[:model.rowCount()], n)
+
+            fresh = MonthTableModel(data)
+            np.testing.assert_array_equal(fresh._rows, model._rows)
+            for a, b in zip(fresh._totals, model._totals):
+                np.testing.assert_allclose(a, b)
+        del app
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+"""
+Store of the trackpoints of each session
+
+The trackpoints of every session are kept in one binary file alongside the
+csv (e.g. ~/.mycycle/mycycle.csv.tracks), as fixed-size records of time,
+latitude, longitude, elevation and speed. A second file,
+mycycle.csv.tracks.idx, holds one fixed-size entry per session, giving its
+date, start time and where its trackpoints are, and the time and distance of
+the row of the Data object it belongs to.
+
+A session's trackpoints are memory-mapped when they are opened, so only the
+parts that are used are read into memory. As the index entries are all the
+same size, finding a session only needs one entry of the index to be read.
+"""
+
+import os.path
+import numpy as np
+from gpximport import haversine, summarise_ride
+from schema import minsec_to_sec
+from undo import CellChanged, RowAdded, RowRemoved
+
+# one trackpoint
+point_dtype = np.dtype([('time', '<M8[ms]'), ('lat', '<f8'), ('lon', '<f8'),
+                        ('ele', '<f4'), ('speed', '<f4')])
+
+# one session: date, time of first trackpoint, index of first trackpoint,
+# number of trackpoints, time (in seconds) and distance (in km) of the
+# session's row and whether that row has been removed
+index_dtype = np.dtype([('date', '<M8[D]'), ('start', '<M8[ms]'),
+                        ('offset', '<i8'), ('count', '<i8'),
+                        ('time', '<i8'), ('dist', '<f8'),
+                        ('removed', '<i8')])
+
+# columns of the Data object which link a row to its session
+key_columns = ['date', 'time', 'distance (km)']
+
+
+def track_path(csvfile):
+    """ Return path of the trackpoint file for `csvfile`. """
+    return csvfile + '.tracks'
+
+
+def speeds(times, lat, lon):
+    """ Return array of speed (in km/h) at each trackpoint.
+
+        The speed at each point is that since the previous point; the first
+        point has the speed to the second.
+    """
+    if len(times) < 2:
+        return np.zeros(len(times), dtype=np.float32)
+    dist = haversine(lat, lon)
+    dt = np.diff(times).astype(np.int64) / 3.6e6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(dt > 0, dist / dt, 0)
+    return np.concatenate((speed[:1], speed)).astype(np.float32)
+
+
+def _rowNow(row, later):
+    """ Return the index now of what was row `row` before the changes in
+        list `later`, which add and remove rows.
+    """
+    for change in later:
+        if isinstance(change, RowAdded) and row >= change.row:
+            row += 1
+        elif isinstance(change, RowRemoved) and row > change.row:
+            row -= 1
+    return row
+
+
+class TrackStore:
+
+    def __init__(self, csvfile):
+        """ Trackpoints of each session of the data in `csvfile`.
+
+            Sessions are numbered in the order they were added. `sessions`
+            gives the numbers of the sessions on a date and `forRow` opens the
+            session for a row of a Data object.
+
+            Each session is linked to its row by the row's date, time and
+            distance, as given to `add`. `follow` keeps the links up to date
+            as the Data object is changed.
+        """
+        self.fname = track_path(csvfile)
+        self.indexfile = self.fname + '.idx'
+        # Data object given to `follow` and the function subscribed to it
+        self._following = None
+
+    def __len__(self):
+        if not os.path.exists(self.indexfile):
+            return 0
+        return os.path.getsize(self.indexfile) // index_dtype.itemsize
+
+    def _index(self):
+        """ Return memory-mapped array of index entries. """
+        num = len(self)
+        if num == 0:
+            return np.zeros(0, dtype=index_dtype)
+        return np.memmap(self.indexfile, dtype=index_dtype, mode='r',
+                         shape=(num,))
+
+    def add(self, times, lat, lon, ele=None, time=None, dist=None):
+        """ Add session with trackpoints at `times`, `lat`, `lon` and
+            elevation `ele`. Returns the number of the new session.
+
+            `time` (in seconds) and `dist` (in km) are those of the session's
+            row in the Data object. By default, they are the moving time and
+            distance found by `gpximport.summarise_ride`.
+        """
+        num = len(times)
+        if ele is None:
+            ele = np.full(num, np.nan)
+        if time is None or dist is None:
+            _, secs, km = summarise_ride(np.asarray(times), lat, lon)
+            time = secs if time is None else time
+            dist = km if dist is None else dist
+
+        points = np.empty(num, dtype=point_dtype)
+        points['time'] = times
+        points['lat'] = lat
+        points['lon'] = lon
+        points['ele'] = ele
+        points['speed'] = speeds(points['time'], lat, lon)
+
+        # a partly written trackpoint, from a write that didn't finish, is
+        # overwritten
+        size = os.path.getsize(self.fname) if os.path.exists(self.fname) else 0
+        offset = size // point_dtype.itemsize
+        with open(self.fname, 'r+b' if size else 'wb') as fileobj:
+            fileobj.seek(offset * point_dtype.itemsize)
+            fileobj.write(points.tobytes())
+
+        # the trackpoints are written before the index entry, so the index
+        # never refers to missing trackpoints
+        entry = np.zeros(1, dtype=index_dtype)
+        if num > 0:
+            entry['date'] = points['time'][0].astype('datetime64[D]')
+            entry['start'] = points['time'][0]
+        entry['offset'] = offset
+        entry['count'] = num
+        entry['time'] = time
+        entry['dist'] = round(dist, 2)
+        # likewise, a partly written entry is overwritten, so that it doesn't
+        # put every later entry out of line
+        session = len(self)
+        exists = os.path.exists(self.indexfile)
+        with open(self.indexfile, 'r+b' if exists else 'wb') as fileobj:
+            fileobj.truncate(session * index_dtype.itemsize)
+            fileobj.seek(session * index_dtype.itemsize)
+            fileobj.write(entry.tobytes())
+
+        return session
+
+    def _setRemoved(self, session, removed):
+        """ Mark `session` as removed, or not, in the index file. """
+        entry = self._index()[session].copy()
+        entry['removed'] = removed
+        with open(self.indexfile, 'r+b') as fileobj:
+            fileobj.seek(session * index_dtype.itemsize)
+            fileobj.write(entry.tobytes())
+
+    def _setKey(self, session, key):
+        """ Link `session` to the row with date, time and distance `key`. """
+        entry = self._index()[session].copy()
+        entry['date'], entry['time'], entry['dist'] = key
+        with open(self.indexfile, 'r+b') as fileobj:
+            fileobj.seek(session * index_dtype.itemsize)
+            fileobj.write(entry.tobytes())
+
+    def open(self, session):
+        """ Return read-only memory-mapped array of the trackpoints of
+            `session`, with fields 'time', 'lat', 'lon', 'ele' and 'speed'.
+        """
+        num = len(self)
+        if session < 0:
+            session += num
+        if not 0 <= session < num:
+            raise IndexError('Session index out of range')
+
+        with open(self.indexfile, 'rb') as fileobj:
+            fileobj.seek(session * index_dtype.itemsize)
+            entry = np.frombuffer(fileobj.read(index_dtype.itemsize),
+                                  dtype=index_dtype)[0]
+
+        count = int(entry['count'])
+        if count == 0:
+            return np.zeros(0, dtype=point_dtype)
+        return np.memmap(self.fname, dtype=point_dtype, mode='r',
+                         offset=int(entry['offset']) * point_dtype.itemsize,
+                         shape=(count,))
+
+    def sessions(self, date):
+        """ Return list of sessions on `date`, in order of start time. """
+        index = self._index()
+        idx = np.flatnonzero((index['date'] == np.datetime64(str(date), 'D'))
+                             & (index['removed'] == 0))
+        order = np.argsort(index['start'][idx], kind='stable')
+        return idx[order].tolist()
+
+    def _find(self, key, removed=False):
+        """ Return list of sessions linked to rows with date, time and
+            distance `key`, in order of start time.
+        """
+        index = self._index()
+        date, time, dist = key
+        idx = np.flatnonzero((index['date'] == date) & (index['time'] == time)
+                             & (index['dist'] == dist)
+                             & (index['removed'] == int(removed)))
+        order = np.argsort(index['start'][idx], kind='stable')
+        return idx[order].tolist()
+
+    @staticmethod
+    def _rowKey(data, values):
+        """ Return date, time and distance from list of `values` of a row of
+            `data`.
+        """
+        date, time, dist = (values[data._getColumnIndex(name)]
+                            for name in key_columns)
+        return (np.datetime64(str(date), 'D'), minsec_to_sec(time),
+                round(float(dist), 2))
+
+    def forRow(self, data, idx):
+        """ Return trackpoints of the session in row `idx` of `data`, or None
+            if there are none.
+
+            Rows are matched with sessions by date, time and distance. If
+            more than one row has the same values, they are matched with the
+            sessions in order.
+        """
+        idx = data._checkRowIndex(idx)
+        key = self._rowKey(data, data.getRow(idx))
+        sessions = self._find(key)
+        # number of earlier rows with the same date, time and distance
+        date, time, dist = (data.getColumn(name)[:idx]
+                            for name in key_columns)
+        nth = int(np.sum((date == key[0]) & (time == key[1])
+                         & (np.round(dist, 2) == key[2])))
+        if nth >= len(sessions):
+            return None
+        return self.open(sessions[nth])
+
+    def follow(self, data):
+        """ Keep the links between the rows of `data` and the sessions up to
+            date as the data are changed.
+
+            When a row with a session is removed, e.g. by undoing the import
+            that added it, the session is marked as removed. It is restored if
+            the row is added back. If the date, time or distance of the row
+            is edited, the session is linked to the new values.
+        """
+        def changed(changes):
+            self._dataChanged(data, changes)
+        self.unfollow()
+        self._following = (data, changed)
+        data.subscribe(changed)
+
+    def unfollow(self):
+        """ Stop following the Data object given to `follow`. """
+        if self._following is not None:
+            data, changed = self._following
+            data.unsubscribe(changed)
+        self._following = None
+
+    def _dataChanged(self, data, changes):
+        """ Update the sessions linked to the rows in list of `changes`. """
+        if len(self) == 0:
+            return
+        keys = [data._getColumnIndex(name) for name in key_columns]
+
+        # the values of each edited row before each change are found by
+        # going back through the changes from the data as they are now
+        ops = []
+        rows = {}
+        later = []
+        for change in reversed(changes):
+            if isinstance(change, RowAdded):
+                rows = {row - (row > change.row): values
+                        for row, values in rows.items() if row != change.row}
+                ops.append(('added', self._rowKey(data, change.values)))
+            elif isinstance(change, RowRemoved):
+                rows = {row + (row >= change.row): values
+                        for row, values in rows.items()}
+                rows[change.row] = list(change.values)
+                ops.append(('removed', self._rowKey(data, change.values)))
+            elif isinstance(change, CellChanged):
+                if change.row not in rows:
+                    rows[change.row] = data.getRow(_rowNow(change.row, later))
+                values = rows[change.row]
+                if change.col in keys:
+                    new = self._rowKey(data, values)
+                    values[change.col] = change.old
+                    ops.append(('edited', self._rowKey(data, values), new))
+                else:
+                    values[change.col] = change.old
+            if isinstance(change, (RowAdded, RowRemoved)):
+                later.insert(0, change)
+
+        for op, key, *new in reversed(ops):
+            if op == 'removed':
+                sessions = self._find(key)
+                if sessions:
+                    self._setRemoved(sessions[-1], True)
+            elif op == 'added':
+                sessions = self._find(key, removed=True)
+                if sessions:
+                    self._setRemoved(sessions[0], False)
+            else:
+                sessions = self._find(key)
+                if sessions:
+                    self._setKey(sessions[0], new[0])
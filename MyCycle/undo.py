@@ -0,0 +1,109 @@
+"""
+Undo/redo history for Data.
+
+The records of each change are also sent to anything subscribed to the Data
+object, so that views can update just the rows and cells which changed.
+
+Each change is stored as a small diff record: the old and new value of a
+changed cell, or the index and values of an added or removed row. No
+copies of the whole data are made, so each step costs the same however
+many sessions there are.
+"""
+
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+# cell `row`,`col` changed from `old` to `new`
+CellChanged = namedtuple('CellChanged', ['row', 'col', 'old', 'new'])
+# row with `values` added at index `row`
+RowAdded = namedtuple('RowAdded', ['row', 'values'])
+# row with `values` removed from index `row`
+RowRemoved = namedtuple('RowRemoved', ['row', 'values'])
+# every row replaced, e.g. when the file is read again; this is only sent
+# to subscribers and is never part of the undo history
+Reloaded = namedtuple('Reloaded', [])
+
+
+class UndoStack:
+
+    def __init__(self, depth=100):
+        """ Stack of undo steps, where each step is a list of diff records.
+
+            Parameters
+            ----------
+            depth : int, optional
+                maximum number of steps that can be undone. Default is 100.
+        """
+        self._undo = deque(maxlen=depth)
+        self._redo = []
+        # step being recorded by `group`
+        self._step = None
+        # don't record changes made while undoing or redoing
+        self._paused = False
+
+    @property
+    def depth(self):
+        return self._undo.maxlen
+
+    def canUndo(self):
+        return len(self._undo) > 0
+
+    def canRedo(self):
+        return len(self._redo) > 0
+
+    def record(self, diff):
+        """ Add `diff` to the history. """
+        if self._paused:
+            return
+        if self._step is not None:
+            self._step.append(diff)
+        else:
+            self._undo.append([diff])
+        self._redo = []
+
+    @contextmanager
+    def group(self):
+        """ Context manager in which all changes make a single undo step. """
+        if self._step is not None:
+            # already in a group
+            yield
+            return
+        self._step = []
+        try:
+            yield
+        finally:
+            step, self._step = self._step, None
+            if step:
+                self._undo.append(step)
+
+    @contextmanager
+    def paused(self):
+        """ Context manager in which changes are not recorded. """
+        self._paused = True
+        try:
+            yield
+        finally:
+            self._paused = False
+
+    def popUndo(self):
+        """ Return the most recent step and move it to the redo stack. """
+        step = self._undo.pop()
+        self._redo.append(step)
+        return step
+
+    def popRedo(self):
+        """ Return the most recently undone step and move it back to the
+            undo stack.
+        """
+        step = self._redo.pop()
+        self._undo.append(step)
+        return step
+
+    def shiftRows(self, pos, num):
+        """ Add `num` to every row index from `pos` onwards, after `num` rows
+            have been inserted at `pos` without being recorded.
+        """
+        for stack in [self._undo, self._redo]:
+            for step in stack:
+                step[:] = [diff._replace(row=diff.row + num)
+                           if diff.row >= pos else diff for diff in step]